@@ -1,18 +1,42 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, Date, Boolean, Sequence, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
+from .utils.metrics import InstrumentedQueuePool, instrument_engine
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db:5432/urlioin")
 
+# Request handlers use the asyncpg engine; the sync engine is kept for
+# schema creation and maintenance scripts
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    poolclass=InstrumentedQueuePool
+)
+instrument_engine(async_engine, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# Each value leases a block of short code indexes to one worker (see utils/shortcode.py)
+short_code_block_seq = Sequence("short_code_block_seq", metadata=Base.metadata)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -27,6 +51,11 @@ class User(Base):
     
     urls = relationship("URL", back_populates="user")
     warnings = relationship("UserWarning", back_populates="user")
+    
+    __table_args__ = (
+        # Keyset pagination of the admin user listing
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
 
 class URL(Base):
     __tablename__ = "urls"
@@ -42,18 +71,70 @@ class URL(Base):
     
     user = relationship("User", back_populates="urls")
     visits = relationship("URLVisit", back_populates="url")
+    
+    __table_args__ = (
+        # Keyset pagination of a user's links on (created_at, id)
+        Index("ix_urls_user_id_created_at_id", "user_id", "created_at", "id"),
+        # Flagged links are rare; the dashboard lists them all
+        Index("ix_urls_flagged", "id", postgresql_where=is_flagged),
+    )
 
 class URLVisit(Base):
+    """Raw visits, range-partitioned by month on created_at (see utils/partitions.py)."""
     __tablename__ = "url_visits"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True, index=True)
     url_id = Column(Integer, ForeignKey("urls.id"))
     ip_address = Column(String(45))
     country = Column(String(100))
     user_agent = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Part of the primary key because Postgres requires the partition key in it
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     
     url = relationship("URL", back_populates="visits")
+    
+    __table_args__ = (
+        # Recent-visits lookups per link, and per-link exports streamed in
+        # (created_at, id) order without sorting first
+        Index("ix_url_visits_url_id_created_at_id", "url_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class URLDailyStat(Base):
+    """Clicks per link, UTC day and country, kept up to date by the click flusher."""
+    __tablename__ = "url_daily_stats"
+    
+    url_id = Column(Integer, ForeignKey("urls.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    country = Column(String(100), primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # Recently clicked links for the cache warmer, answered from the index alone
+        Index("ix_url_daily_stats_day", "day", postgresql_include=["url_id", "clicks"]),
+    )
+
+class UserStat(Base):
+    """Per-user link and click totals, maintained incrementally and reconciled periodically."""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    url_count = Column(BigInteger, nullable=False, default=0)
+    total_clicks = Column(BigInteger, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_user_stats_total_clicks", "total_clicks"),
+    )
+
+class SiteStat(Base):
+    """Global totals for the admin dashboard, spread over SITE_STAT_SLOTS rows
+    (see utils/counters.py) and summed on read."""
+    __tablename__ = "site_stats"
+    
+    id = Column(Integer, primary_key=True)
+    total_users = Column(BigInteger, nullable=False, default=0)
+    total_urls = Column(BigInteger, nullable=False, default=0)
+    total_clicks = Column(BigInteger, nullable=False, default=0)
 
 class UserWarning(Base):
     __tablename__ = "user_warnings"
@@ -67,9 +148,26 @@ class UserWarning(Base):
     
     user = relationship("User", back_populates="warnings")
 
-def get_db():
-    db = SessionLocal()
+class LazySession:
+    """AsyncSession proxy that only creates (and checks out a connection for) a
+    real session on first use, so handlers served from cache never touch the pool."""
+
+    def __init__(self):
+        self._session = None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = AsyncSessionLocal()
+        return getattr(self._session, name)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+async def get_db():
+    db = LazySession()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
\ No newline at end of file
@@ -1,49 +1,92 @@
+import time
+
+# Measured from here to the end of lifespan startup; see STARTUP_TARGET_SECONDS
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
-import uvicorn
+import asyncio
 import os
-import time
 import logging
 
-from .database import engine, Base
-from .routes import auth, user, redirect, seo, admin
+from .database import async_engine
+from .routes import auth, user, redirect, seo, admin, public, qr, metrics
+from .utils.cache import start_filter_maintainer, start_invalidation_listener
+from .utils.clicks import click_ingestor
+from .utils.counters import start_reconciler
+from .utils.partitions import start_partition_maintainer
+from .utils.qr import qr_cache
+from .utils.passwords import password_hasher
+from .utils.redis_client import redis_client
+from .utils.warmer import CACHE_WARM_TIMEOUT, start_cache_warmer, warm_caches
 from .utils.i18n import i18n
+from .utils.metrics import STARTUP_TIME, MetricsMiddleware
+from .utils.ratelimit import AdmissionMiddleware
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def wait_for_db():
-    """Wait for database to be ready"""
-    max_retries = 30
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            # Try to connect to database
-            Base.metadata.create_all(bind=engine)
-            logger.info("Database connection successful!")
-            break
-        except Exception as e:
-            retry_count += 1
-            logger.info(f"Database not ready, retrying... ({retry_count}/{max_retries})")
-            time.sleep(2)
-    
-    if retry_count == max_retries:
-        logger.error("Could not connect to database after maximum retries")
-        raise Exception("Database connection failed")
-
-# Wait for database and create tables
-wait_for_db()
+# Seconds from import to serving that a worker should stay under; slower starts are logged
+STARTUP_TARGET_SECONDS = float(os.getenv("STARTUP_TARGET_SECONDS", "1.0"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is prepared once before workers start (app/schema.py), so
+    # startup only launches this worker's background tasks
+    await click_ingestor.start()
+    background = [
+        # Keep this worker's L1 caches and Bloom filter coherent with the others
+        start_invalidation_listener(redis_client),
+        # Deliver creation announcements that failed and rebuild the Bloom filter as a backstop
+        start_filter_maintainer(redis_client),
+        # Periodically correct drift in the admin dashboard counters
+        start_reconciler(redis_client),
+        # Create upcoming url_visits partitions and retire expired ones
+        start_partition_maintainer(redis_client),
+        # Keep the hottest links cached in Redis and the L1
+        start_cache_warmer(redis_client)
+    ]
+
+    # Serve the hottest links from cache from the first request on
+    try:
+        await asyncio.wait_for(warm_caches(redis_client), CACHE_WARM_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Startup cache warm-up skipped: {e!r}")
+
+    elapsed = time.perf_counter() - _import_started
+    STARTUP_TIME.set(elapsed)
+    if elapsed > STARTUP_TARGET_SECONDS:
+        logger.warning(f"Worker {os.getpid()} took {elapsed:.2f}s to start (target {STARTUP_TARGET_SECONDS}s)")
+    else:
+        logger.info(f"Worker {os.getpid()} ready in {elapsed:.2f}s")
+
+    yield
+
+    # Write out visits still queued before the worker exits
+    await click_ingestor.stop()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await redis_client.aclose()
+    await async_engine.dispose()
+    qr_cache.shutdown()
+    password_hasher.shutdown()
 
 app = FastAPI(
     title="urlio.in",
     description="Smart Links. Global Reach. | Akıllı Bağlantılar. Küresel Erişim.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Shed API requests before redirects when this worker is saturated; added
+# first so it runs inside CORS and shed responses still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -51,8 +94,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Request latency and per-dependency timings for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -60,7 +107,10 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(seo.router)  # SEO routes FIRST (sitemap.xml, robots.txt)
 app.include_router(auth.router)
 app.include_router(user.router)
+app.include_router(public.router)
+app.include_router(qr.router)
 app.include_router(admin.router)  # Admin routes
+app.include_router(metrics.router)  # Prometheus scrape endpoint
 app.include_router(redirect.router)  # Redirect LAST (catches all /{short_code})
 
 @app.get("/")
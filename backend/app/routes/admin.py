@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional
-from ..database import get_db, User, URL, URLVisit, UserWarning
+from datetime import datetime
+from ..utils.redis_client import redis_client
+import json
+import os
+from ..database import AsyncSessionLocal, get_db, User, URL, URLVisit, UserStat, UserWarning
 from ..utils.auth import verify_token
-from ..utils.helpers import hash_password
+from ..utils.passwords import password_hasher
+from ..utils.counters import record_link_deleted, site_totals
+from ..utils.cache import CachedUser, cache_url, invalidate_url, invalidate_user, l1_cache, resolve_user, url_cache_key, user_l1_cache
 from ..utils.i18n import i18n
+from ..utils.trending import TRENDING_DEFAULT_WINDOW, TRENDING_MAX_WINDOW, top_trending
+from ..utils.exports import EXPORT_FORMATS, export_filename, stream_visits, visit_filters
+from ..utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, page_size, keyset_page, parse_fields, projection, render, split_page
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -18,7 +28,7 @@ class WarningMessage(BaseModel):
     message: str
     url_id: Optional[int] = None
 
-def get_admin_user(authorization: str = Header(None), db: Session = Depends(get_db)):
+async def get_admin_user(authorization: str = Header(None), db: AsyncSession = Depends(get_db)):
     """Verify admin user"""
     if not authorization:
         raise HTTPException(
@@ -29,7 +39,7 @@ def get_admin_user(authorization: str = Header(None), db: Session = Depends(get_
     try:
         token = authorization.split(" ")[1]
         username = verify_token(token)
-        user = db.query(User).filter(User.username == username).first()
+        user = await resolve_user(redis_client, db, username)
         
         if not user or not user.is_admin:
             raise HTTPException(
@@ -46,32 +56,32 @@ def get_admin_user(authorization: str = Header(None), db: Session = Depends(get_
 
 @router.get("/dashboard")
 async def get_admin_dashboard(
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get admin dashboard statistics
+    Get admin dashboard statistics from the incrementally maintained counters
     """
     
     # Total statistics
-    total_users = db.query(func.count(User.id)).filter(User.is_admin == False).scalar()
-    total_urls = db.query(func.count(URL.id)).scalar()
-    total_clicks = db.query(func.sum(URL.click_count)).scalar() or 0
-    
-    # Users with their stats
-    users_stats = db.query(
-        User.id,
-        User.username,
-        User.email,
-        User.is_active,
-        User.created_at,
-        func.count(URL.id).label('url_count'),
-        func.sum(URL.click_count).label('total_clicks')
-    ).join(URL, User.id == URL.user_id, isouter=True)\
-     .filter(User.is_admin == False)\
-     .group_by(User.id)\
-     .order_by(desc('total_clicks'))\
-     .all()
+    site = await site_totals(db)
+    
+    # Top users by clicks, walked from the user_stats click index
+    users_stats = (await db.execute(
+        select(
+            User.id,
+            User.username,
+            User.email,
+            User.is_active,
+            User.created_at,
+            UserStat.url_count,
+            UserStat.total_clicks
+        ).join(UserStat, User.id == UserStat.user_id)
+         .where(User.is_admin == False)
+         .order_by(UserStat.total_clicks.desc(), User.id)
+         .limit(limit)
+    )).all()
     
     users_list = []
     for user in users_stats:
@@ -86,10 +96,11 @@ async def get_admin_dashboard(
         })
     
     # Flagged URLs
-    flagged_urls = db.query(URL, User.username)\
-        .join(User, URL.user_id == User.id)\
-        .filter(URL.is_flagged == True)\
-        .all()
+    flagged_urls = (await db.execute(
+        select(URL, User.username)
+        .join(User, URL.user_id == User.id)
+        .where(URL.is_flagged == True)
+    )).all()
     
     flagged_list = []
     for url, username in flagged_urls:
@@ -106,70 +117,134 @@ async def get_admin_dashboard(
         "success": True,
         "data": {
             "statistics": {
-                "total_users": total_users,
-                "total_urls": total_urls,
-                "total_clicks": total_clicks
+                "total_users": site["total_users"],
+                "total_urls": site["total_urls"],
+                "total_clicks": site["total_clicks"]
             },
             "users": users_list,
             "flagged_urls": flagged_list
         }
     }
 
+ADMIN_URL_FIELDS = {
+    "id": ((URL.id,), lambda row: row.id),
+    "short_code": ((URL.short_code,), lambda row: row.short_code),
+    "original_url": ((URL.original_url,), lambda row: row.original_url),
+    "click_count": ((URL.click_count,), lambda row: row.click_count),
+    "is_flagged": ((URL.is_flagged,), lambda row: row.is_flagged),
+    "created_at": ((URL.created_at,), lambda row: row.created_at.isoformat()),
+}
+
+# Server-side cursor batch size for streamed admin listings
+STREAM_YIELD_PER = int(os.getenv('STREAM_YIELD_PER', '1000'))
+
+async def _stream_users(user_filters, names, ndjson: bool, next_cursor: Optional[str]):
+    """
+    One query joins users to their URLs with per-user totals as window
+    aggregates; rows arrive through a server-side cursor already grouped by
+    user, so each user is emitted as soon as its last URL row is read.
+    """
+    
+    stmt = select(
+        User.id.label("user_id"),
+        User.username,
+        User.email,
+        User.is_active,
+        User.created_at.label("user_created_at"),
+        func.count(URL.id).over(partition_by=User.id).label("url_count"),
+        func.coalesce(func.sum(URL.click_count).over(partition_by=User.id), 0).label("total_clicks"),
+        *projection(ADMIN_URL_FIELDS, names, URL.id)
+    ).join(URL, User.id == URL.user_id, isouter=True)\
+     .where(*user_filters)\
+     .order_by(User.created_at.desc(), User.id.desc(), URL.created_at.desc(), URL.id.desc())\
+     .execution_options(yield_per=STREAM_YIELD_PER)
+    
+    def encode_user(user: dict, first: bool) -> str:
+        encoded = json.dumps(user, ensure_ascii=False, default=str)
+        if ndjson:
+            return encoded + "\n"
+        return encoded if first else "," + encoded
+    
+    if not ndjson:
+        yield '{"success":true,"data":['
+    
+    first = True
+    current = None
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt)
+        async for row in result:
+            if current is None or current["id"] != row.user_id:
+                if current is not None:
+                    yield encode_user(current, first)
+                    first = False
+                current = {
+                    "id": row.user_id,
+                    "username": row.username,
+                    "email": row.email,
+                    "is_active": row.is_active,
+                    "created_at": row.user_created_at.isoformat(),
+                    "url_count": row.url_count,
+                    "total_clicks": row.total_clicks,
+                    "urls": []
+                }
+            if row.id is not None:
+                current["urls"].append(render(row, ADMIN_URL_FIELDS, names))
+    
+    if current is not None:
+        yield encode_user(current, first)
+    
+    if not ndjson:
+        yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+
 @router.get("/users")
 async def get_all_users(
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all users with their URLs and statistics
+    Stream users with their URLs and statistics, newest first. Without limit
+    every user is streamed; with limit one keyset page is returned.
     """
     
-    users = db.query(User).filter(User.is_admin == False).all()
-    
-    users_data = []
-    for user in users:
-        user_urls = db.query(URL).filter(URL.user_id == user.id).all()
-        total_clicks = sum(url.click_count for url in user_urls)
-        
-        users_data.append({
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "is_active": user.is_active,
-            "created_at": user.created_at.isoformat(),
-            "url_count": len(user_urls),
-            "total_clicks": total_clicks,
-            "urls": [
-                {
-                    "id": url.id,
-                    "short_code": url.short_code,
-                    "original_url": url.original_url,
-                    "click_count": url.click_count,
-                    "is_flagged": url.is_flagged,
-                    "created_at": url.created_at.isoformat()
-                }
-                for url in user_urls
-            ]
-        })
-    
-    return {
-        "success": True,
-        "data": users_data
-    }
+    names = parse_fields(fields, ADMIN_URL_FIELDS)
+    user_filters = [User.is_admin == False]
+    next_cursor = None
+    
+    if limit is not None:
+        # Resolve the page's user ids first so the streamed join stays bounded
+        page = (await db.execute(keyset_page(
+            select(User.id, User.created_at).where(User.is_admin == False),
+            User.created_at, User.id, cursor, limit
+        ))).all()
+        page, next_cursor = split_page(page, limit)
+        user_filters.append(User.id.in_([user.id for user in page]))
+    elif cursor:
+        created_at, user_id = decode_cursor(cursor)
+        user_filters.append(tuple_(User.created_at, User.id) < tuple_(created_at, user_id))
+    
+    ndjson = format == "ndjson"
+    return StreamingResponse(
+        _stream_users(user_filters, names, ndjson, next_cursor),
+        media_type="application/x-ndjson" if ndjson else "application/json"
+    )
 
 @router.post("/users/{user_id}/warn")
 async def send_warning_to_user(
     user_id: int,
     warning: WarningMessage,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Send warning message to a user
     """
     
     # Check if user exists
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(
             status_code=404,
@@ -184,7 +259,7 @@ async def send_warning_to_user(
     )
     
     db.add(new_warning)
-    db.commit()
+    await db.commit()
     
     return {
         "success": True,
@@ -197,14 +272,14 @@ async def send_warning_to_user(
 @router.post("/urls/{url_id}/flag")
 async def flag_url(
     url_id: int,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Flag a URL as inappropriate
     """
     
-    url = db.query(URL).filter(URL.id == url_id).first()
+    url = await db.scalar(select(URL).where(URL.id == url_id))
     if not url:
         raise HTTPException(
             status_code=404,
@@ -212,7 +287,11 @@ async def flag_url(
         )
     
     url.is_flagged = True
-    db.commit()
+    await db.commit()
+    
+    # Refresh the cached record so redirects see the flag
+    await cache_url(redis_client, url)
+    await invalidate_url(redis_client, url.short_code)
     
     return {
         "success": True,
@@ -225,26 +304,34 @@ async def flag_url(
 @router.delete("/urls/{url_id}")
 async def delete_url(
     url_id: int,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a URL (admin only)
     """
     
-    url = db.query(URL).filter(URL.id == url_id).first()
+    # Lock the URL row first, as the click flusher does before touching the
+    # rollup, so a delete racing a flush waits instead of deadlocking
+    url = await db.scalar(select(URL).where(URL.id == url_id).with_for_update())
     if not url:
         raise HTTPException(
             status_code=404,
             detail={"message": {"en": "URL not found", "tr": "URL bulunamadı"}}
         )
     
-    # Delete associated visits
-    db.query(URLVisit).filter(URLVisit.url_id == url_id).delete()
+    # Delete associated visits; url_daily_stats rows go with the URL (ON DELETE CASCADE)
+    await db.execute(delete(URLVisit).where(URLVisit.url_id == url_id))
     
     # Delete URL
-    db.delete(url)
-    db.commit()
+    short_code = url.short_code
+    await db.execute(delete(URL).where(URL.id == url_id))
+    await record_link_deleted(db, url.user_id, url.click_count or 0)
+    await db.commit()
+    
+    # Drop the cached record so redirects stop resolving it
+    await redis_client.delete(url_cache_key(short_code))
+    await invalidate_url(redis_client, short_code)
     
     return {
         "success": True,
@@ -257,8 +344,8 @@ async def delete_url(
 @router.post("/change-password")
 async def change_admin_password(
     password_data: PasswordChange,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Change admin password
@@ -270,8 +357,10 @@ async def change_admin_password(
             detail={"message": {"en": "Password must be at least 6 characters", "tr": "Şifre en az 6 karakter olmalı"}}
         )
     
-    admin.password_hash = hash_password(password_data.new_password)
-    db.commit()
+    admin_record = await db.get(User, admin.id)
+    admin_record.password_hash = await password_hasher.hash(password_data.new_password)
+    await db.commit()
+    await invalidate_user(redis_client, admin.username)
     
     return {
         "success": True,
@@ -284,14 +373,14 @@ async def change_admin_password(
 @router.post("/users/{user_id}/toggle-status")
 async def toggle_user_status(
     user_id: int,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Activate or deactivate a user
     """
     
-    user = db.query(User).filter(User.id == user_id, User.is_admin == False).first()
+    user = await db.scalar(select(User).where(User.id == user_id, User.is_admin == False))
     if not user:
         raise HTTPException(
             status_code=404,
@@ -299,7 +388,8 @@ async def toggle_user_status(
         )
     
     user.is_active = not user.is_active
-    db.commit()
+    await db.commit()
+    await invalidate_user(redis_client, user.username)
     
     status_text = "activated" if user.is_active else "deactivated"
     status_text_tr = "aktif edildi" if user.is_active else "devre dışı bırakıldı"
@@ -316,32 +406,40 @@ async def toggle_user_status(
 @router.get("/users/{user_id}/urls")
 async def get_user_urls(
     user_id: int,
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all URLs created by a specific user
+    Get URLs created by a specific user, newest first. Without cursor or limit
+    every URL is returned; otherwise one keyset page at a time
     """
     
-    user = db.query(User).filter(User.id == user_id).first()
+    limit = page_size(cursor, limit)
+    
+    user = (await db.execute(
+        select(User.id, User.username, User.email).where(User.id == user_id)
+    )).first()
     if not user:
         raise HTTPException(
             status_code=404,
             detail={"message": {"en": "User not found", "tr": "Kullanıcı bulunamadı"}}
         )
     
-    urls = db.query(URL).filter(URL.user_id == user_id).order_by(desc(URL.created_at)).all()
+    names = parse_fields(fields, ADMIN_URL_FIELDS)
+    urls = (await db.execute(keyset_page(
+        select(*projection(ADMIN_URL_FIELDS, names, URL.id, URL.created_at))
+        .where(URL.user_id == user_id),
+        URL.created_at, URL.id, cursor, limit
+    ))).all()
+    urls, next_cursor = split_page(urls, limit)
     
-    urls_list = []
-    for url in urls:
-        urls_list.append({
-            "id": url.id,
-            "short_code": url.short_code,
-            "original_url": url.original_url,
-            "click_count": url.click_count,
-            "is_flagged": url.is_flagged,
-            "created_at": url.created_at.isoformat()
-        })
+    # Only counted for the first page; later pages just follow the cursor
+    total_urls = None
+    if not cursor:
+        total_urls = await db.scalar(select(func.count(URL.id)).where(URL.user_id == user_id))
     
     return {
         "success": True,
@@ -350,6 +448,85 @@ async def get_user_urls(
             "username": user.username,
             "email": user.email
         },
-        "urls": urls_list,
-        "total_urls": len(urls_list)
+        "urls": [render(url, ADMIN_URL_FIELDS, names) for url in urls],
+        "total_urls": total_urls,
+        "next_cursor": next_cursor
+    }
+
+@router.get("/trending")
+async def get_trending(
+    window: int = Query(TRENDING_DEFAULT_WINDOW, ge=1, le=TRENDING_MAX_WINDOW),
+    limit: int = Query(10, ge=1, le=100),
+    admin: CachedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Site-wide most clicked links over the last window minutes
+    """
+    
+    ranked = await top_trending(redis_client, window, limit)
+    urls = {
+        row.id: row for row in await db.execute(
+            select(URL.id, URL.short_code, URL.original_url, URL.user_id, User.username)
+            .join(User, User.id == URL.user_id, isouter=True)
+            .where(URL.id.in_([url_id for url_id, _ in ranked]))
+        )
+    }
+    
+    return {
+        "success": True,
+        "window_minutes": window,
+        "data": [
+            {
+                "url_id": url_id,
+                "short_code": urls[url_id].short_code,
+                "original_url": urls[url_id].original_url,
+                "user_id": urls[url_id].user_id,
+                "username": urls[url_id].username,
+                "clicks": clicks
+            }
+            for url_id, clicks in ranked if url_id in urls
+        ]
+    }
+
+@router.get("/visits/export")
+async def export_visits(
+    user_id: Optional[int] = None,
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    admin: CachedUser = Depends(get_admin_user)
+):
+    """
+    Stream raw visits filtered by user, link and time range as CSV or NDJSON,
+    optionally gzip-compressed
+    """
+    
+    filters = visit_filters(start, end)
+    if user_id is not None:
+        filters.append(URL.user_id == user_id)
+    if short_code:
+        filters.append(URL.short_code == short_code)
+    
+    scope = short_code or (f"user-{user_id}" if user_id is not None else "all")
+    filename = export_filename(scope, format, gzip)
+    return StreamingResponse(
+        stream_visits(filters, format, gzip, anonymize_ip=False),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/cache-stats")
+async def get_cache_stats(admin: CachedUser = Depends(get_admin_user)):
+    """
+    L1 short-code and user cache counters for the worker serving this request
+    """
+    
+    return {
+        "success": True,
+        "worker_pid": os.getpid(),
+        "l1": l1_cache.stats(),
+        "users": user_l1_cache.stats()
     }
@@ -1,10 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from datetime import timedelta
 from ..database import get_db, User
-from ..utils.helpers import hash_password, verify_password, detect_language
+from ..utils.helpers import detect_language, get_trusted_client_ip
+from ..utils.passwords import needs_rehash, password_hasher
 from ..utils.auth import create_access_token
+from ..utils.counters import record_user_created
+from ..utils.ratelimit import LOGIN_IP_POLICY, LOGIN_USER_POLICY, REGISTER_POLICY, charge, check, limit_by_ip
 from ..utils.i18n import i18n
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -19,25 +23,25 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
-@router.post("/register")
-async def register(user_data: UserRegister, request: Request, db: Session = Depends(get_db)):
+@router.post("/register", dependencies=[Depends(limit_by_ip(REGISTER_POLICY))])
+async def register(user_data: UserRegister, request: Request, db: AsyncSession = Depends(get_db)):
     lang = detect_language(request, user_data.preferred_language)
     
     # Check if user exists
-    if db.query(User).filter(User.username == user_data.username).first():
+    if await db.scalar(select(User.id).where(User.username == user_data.username)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"message": i18n.get_bilingual_response("user_exists")}
         )
     
-    if db.query(User).filter(User.email == user_data.email).first():
+    if await db.scalar(select(User.id).where(User.email == user_data.email)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"message": i18n.get_bilingual_response("user_exists")}
         )
     
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     new_user = User(
         username=user_data.username,
         email=user_data.email,
@@ -46,24 +50,37 @@ async def register(user_data: UserRegister, request: Request, db: Session = Depe
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    await record_user_created(db, new_user.id)
+    await db.commit()
+    await db.refresh(new_user)
     
     return {
         "message": i18n.get_bilingual_response("register_success"),
         "user_id": new_user.id
     }
 
-@router.post("/login")
-async def login(user_data: UserLogin, request: Request, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == user_data.username).first()
+@router.post("/login", dependencies=[Depends(limit_by_ip(LOGIN_IP_POLICY))])
+async def login(user_data: UserLogin, request: Request, db: AsyncSession = Depends(get_db)):
+    # Only failed attempts count, and per IP, so guessing one account is
+    # slowed before any bcrypt work while nobody can lock its owner out
+    login_identity = f"{user_data.username.lower()}:{get_trusted_client_ip(request)}"
+    await check(LOGIN_USER_POLICY, login_identity)
     
-    if not user or not verify_password(user_data.password, user.password_hash):
+    user = await db.scalar(select(User).where(User.username == user_data.username))
+    
+    if not user or not await password_hasher.verify(user_data.password, user.password_hash):
+        await charge(LOGIN_USER_POLICY, login_identity)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"message": i18n.get_bilingual_response("login_failed")}
         )
     
+    # Move the stored hash to the configured cost while the plain password is at hand
+    if needs_rehash(user.password_hash):
+        user.password_hash = await password_hasher.hash(user_data.password)
+        await db.commit()
+    
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+from ..utils.metrics import render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Prometheus exposition of every worker's metrics
+    """
+    
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
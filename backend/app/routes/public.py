@@ -1,26 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-import redis
-import os
-from ..database import get_db, URL
-from ..utils.helpers import generate_short_code, generate_qr_code, detect_language
+from ..utils.redis_client import redis_client
+from ..database import get_db
+from ..utils.cache import announce_created, cache_url
+from ..utils.counters import record_links_created
+from ..utils.qr import qr_code_path
+from ..utils.shortcode import insert_url
+from ..utils.ratelimit import SHORTEN_POLICY, limit_by_ip
 from ..utils.i18n import i18n
 
 router = APIRouter(prefix="/public", tags=["public"])
 
-# Redis client
-redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')  # Use docker service name
-redis_client = redis.from_url(redis_url, decode_responses=True)
-
 class URLShorten(BaseModel):
     original_url: str
 
-@router.post("/shorten")
+@router.post("/shorten", dependencies=[Depends(limit_by_ip(SHORTEN_POLICY))])
 async def shorten_url_public(
     url_data: URLShorten, 
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create short URL without authentication - for anonymous users"""
     
@@ -31,34 +30,28 @@ async def shorten_url_public(
             detail={"message": i18n.get_bilingual_response("invalid_url")}
         )
     
-    # Generate unique short code
-    short_code = generate_short_code()
-    while db.query(URL).filter(URL.short_code == short_code).first():
-        short_code = generate_short_code()
-    
-    # Generate QR code
-    short_url = f"https://urlio.in/{short_code}"
-    qr_code_path = None  # Temporarily disable QR code generation
-    
-    # Create URL record without user_id (anonymous)
-    new_url = URL(
+    # Create URL record without user_id (anonymous) under a fresh short code
+    new_url = await insert_url(
+        db,
         user_id=None,  # Anonymous user
-        original_url=url_data.original_url,
-        short_code=short_code,
-        qr_code_path=qr_code_path
+        original_url=url_data.original_url
     )
+    await record_links_created(db, None)
+    await db.commit()
     
-    db.add(new_url)
-    db.commit()
-    db.refresh(new_url)
+    short_code = new_url.short_code
+    short_url = f"https://urlio.in/{short_code}"
+    # QR code is rendered on first request to its endpoint
+    qr_path = qr_code_path(short_code)
     
     # Cache in Redis
-    redis_client.setex(f"url:{short_code}", 3600, url_data.original_url)
+    await cache_url(redis_client, new_url)
+    await announce_created(redis_client, [short_code])
     
     return {
         "message": i18n.get_bilingual_response("link_created"),
         "short_code": short_code,
         "short_url": short_url,
-        "qr_code_path": qr_code_path,
+        "qr_code_path": qr_path,
         "original_url": url_data.original_url
     }
\ No newline at end of file
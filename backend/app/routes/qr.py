@@ -0,0 +1,50 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+from ..utils.redis_client import redis_client
+import os
+from ..utils.cache import resolve_url
+from ..utils.i18n import i18n
+from ..utils.qr import qr_cache, QR_FORMATS, QR_SIZES, QR_DEFAULT_SIZE
+
+router = APIRouter(prefix="/qr", tags=["qr"])
+
+# Get domain from environment
+DOMAIN = os.getenv('DOMAIN', 'localhost:5173')
+BASE_URL = f"http://{DOMAIN}" if DOMAIN.startswith('localhost') else f"https://{DOMAIN}"
+
+@router.get("/{short_code}")
+async def get_qr_code(
+    short_code: str,
+    format: str = Query("png"),
+    size: int = Query(QR_DEFAULT_SIZE)
+):
+    """
+    Serve the QR code for a short link, rendering and caching it on first request
+    """
+    
+    if format not in QR_FORMATS or size not in QR_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": {
+                "en": f"Format must be one of {', '.join(QR_FORMATS)} and size one of {', '.join(map(str, QR_SIZES))}",
+                "tr": f"Format {', '.join(QR_FORMATS)}, boyut {', '.join(map(str, QR_SIZES))} değerlerinden biri olmalı"
+            }}
+        )
+    
+    if await resolve_url(redis_client, short_code) is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"message": i18n.get_bilingual_response("link_not_found")}
+        )
+    
+    path = await qr_cache.get(f"{BASE_URL}/{short_code}", format, size)
+    
+    # The file name is a hash of the rendered content's inputs, so it never changes
+    return FileResponse(
+        path,
+        media_type=QR_FORMATS[format],
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{os.path.splitext(os.path.basename(path))[0]}"'
+        }
+    )
@@ -1,57 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-import redis
-from ..database import get_db, URL, URLVisit
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import RedirectResponse
+from ..utils.redis_client import redis_client
+from ..utils.cache import resolve_url
+from ..utils.clicks import click_ingestor
 from ..utils.helpers import get_client_ip, get_country_from_ip
 from ..utils.i18n import i18n
-import os
 
 router = APIRouter(tags=["redirect"])
 
-# Redis client with authentication
-redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-redis_client = redis.from_url(redis_url, decode_responses=True)
-
 @router.get("/{short_code}")
-async def redirect_url(short_code: str, request: Request, db: Session = Depends(get_db)):
-    # Try to get URL from Redis cache first
-    cached_url = redis_client.get(f"url:{short_code}")
-    
-    if cached_url:
-        original_url = cached_url
-        url_record = db.query(URL).filter(URL.short_code == short_code).first()
-    else:
-        # Get from database
-        url_record = db.query(URL).filter(URL.short_code == short_code).first()
-        if not url_record:
-            raise HTTPException(
-                status_code=404,
-                detail={"message": i18n.get_bilingual_response("link_not_found")}
-            )
-        
-        original_url = url_record.original_url
-        # Cache for future requests
-        redis_client.setex(f"url:{short_code}", 3600, original_url)
-    
-    if url_record:
-        # Log the visit
-        client_ip = get_client_ip(request)
-        country = get_country_from_ip(client_ip)
-        user_agent = request.headers.get("User-Agent", "")
-        
-        visit = URLVisit(
-            url_id=url_record.id,
-            ip_address=client_ip,
-            country=country,
-            user_agent=user_agent
+async def redirect_url(short_code: str, request: Request):
+    # Per-worker L1 first, then Redis; a hit on either carries everything needed
+    cached = await resolve_url(redis_client, short_code)
+    if cached is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"message": i18n.get_bilingual_response("link_not_found")}
         )
-        
-        db.add(visit)
-        
-        # Update click count
-        url_record.click_count += 1
-        db.commit()
-    
+
+    url_id, original_url = cached.url_id, cached.original_url
+
+    # Queue the visit; the click flusher writes it in a batch
+    client_ip = get_client_ip(request)
+    await click_ingestor.record(
+        url_id,
+        client_ip,
+        get_country_from_ip(client_ip),
+        request.headers.get("User-Agent", "")
+    )
+
     # Return redirect response
-    from fastapi.responses import RedirectResponse
-    return RedirectResponse(url=original_url, status_code=302)
\ No newline at end of file
+    return RedirectResponse(url=original_url, status_code=302)
@@ -1,29 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import Optional
-import redis
+from typing import List, Optional
+from datetime import date, datetime
+from ..utils.redis_client import redis_client
 import json
-from ..database import get_db, User, URL, URLVisit, UserWarning
-from ..utils.helpers import generate_short_code, generate_qr_code, get_client_ip, get_country_from_ip, detect_language
+from ..database import get_db, URL, URLVisit, URLDailyStat, UserWarning
+from ..utils.helpers import detect_language
 from ..utils.auth import verify_token
+from ..utils.counters import record_links_created
+from ..utils.cache import CachedURL, CachedUser, announce_created, cache_url, cache_urls, resolve_user
+from ..utils.uniques import count_unique_visitors
+from ..utils.trending import TRENDING_DEFAULT_WINDOW, TRENDING_MAX_WINDOW, top_trending
+from ..utils.exports import EXPORT_FORMATS, export_filename, stream_visits, visit_filters
+from ..utils.pagination import MAX_PAGE_SIZE, page_size, keyset_page, parse_fields, projection, render, split_page
+from ..utils.qr import qr_code_path
+from ..utils.shortcode import insert_url, insert_urls
 from ..utils.i18n import i18n
 import os
 
 router = APIRouter(prefix="/user", tags=["user"])
 
-# Redis client with authentication
-redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-redis_client = redis.from_url(redis_url, decode_responses=True)
-
 # Get domain from environment
 DOMAIN = os.getenv('DOMAIN', 'localhost:5173')
 BASE_URL = f"http://{DOMAIN}" if DOMAIN.startswith('localhost') else f"https://{DOMAIN}"
 
+# Upper bound on URLs accepted by one bulk shorten request
+BULK_SHORTEN_MAX = int(os.getenv('BULK_SHORTEN_MAX', '50000'))
+# Rows per multi-row INSERT (and per transaction) in bulk shortening
+BULK_INSERT_CHUNK = int(os.getenv('BULK_INSERT_CHUNK', '1000'))
+
 class URLShorten(BaseModel):
     original_url: str
 
-def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+def _parse_bulk_item(item):
+    """Accept either a bare URL string or {"original_url": ...}."""
+    if isinstance(item, dict):
+        item = item.get("original_url")
+    return item if isinstance(item, str) else None
+
+async def _read_bulk_items(request: Request) -> List[Optional[str]]:
+    """Read a JSON array / {"urls": [...]} body, or an NDJSON stream with one item per line."""
+    content_type = request.headers.get("Content-Type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items, buffer = [], b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    try:
+                        items.append(_parse_bulk_item(json.loads(line)))
+                    except ValueError:
+                        items.append(None)
+                if len(items) > BULK_SHORTEN_MAX:
+                    return items
+        if buffer.strip():
+            try:
+                items.append(_parse_bulk_item(json.loads(buffer)))
+            except ValueError:
+                items.append(None)
+        return items
+
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict):
+        body = body.get("urls")
+    if not isinstance(body, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": {"en": "Expected a list of URLs", "tr": "URL listesi bekleniyor"}}
+        )
+    return [_parse_bulk_item(item) for item in body]
+
+async def get_current_user(authorization: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
     if not authorization:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,7 +87,7 @@ def get_current_user(authorization: Optional[str] = Header(None), db: Session =
     try:
         token = authorization.split(" ")[1]  # Remove 'Bearer ' prefix
         username = verify_token(token)
-        user = db.query(User).filter(User.username == username).first()
+        user = await resolve_user(redis_client, db, username)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,8 +104,8 @@ def get_current_user(authorization: Optional[str] = Header(None), db: Session =
 async def shorten_url(
     url_data: URLShorten, 
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     lang = detect_language(request, current_user.preferred_language)
     
@@ -62,49 +116,109 @@ async def shorten_url(
             detail={"message": i18n.get_bilingual_response("invalid_url")}
         )
     
-    # Generate unique short code
-    short_code = generate_short_code()
-    while db.query(URL).filter(URL.short_code == short_code).first():
-        short_code = generate_short_code()
-    
-    # Generate QR code
-    short_url = f"{BASE_URL}/{short_code}"
-    qr_code_path = generate_qr_code(short_url, short_code)
-    
-    # Create URL record
-    new_url = URL(
+    # Create URL record under a fresh short code
+    new_url = await insert_url(
+        db,
         user_id=current_user.id,
-        original_url=url_data.original_url,
-        short_code=short_code,
-        qr_code_path=qr_code_path
+        original_url=url_data.original_url
     )
+    await record_links_created(db, current_user.id)
+    await db.commit()
     
-    db.add(new_url)
-    db.commit()
-    db.refresh(new_url)
+    # QR code is rendered on first request to its endpoint
+    short_code = new_url.short_code
+    short_url = f"{BASE_URL}/{short_code}"
+    qr_path = qr_code_path(short_code)
     
     # Cache in Redis
-    redis_client.setex(f"url:{short_code}", 3600, url_data.original_url)
+    await cache_url(redis_client, new_url)
+    await announce_created(redis_client, [short_code])
     
     return {
         "message": i18n.get_bilingual_response("link_created"),
         "short_code": short_code,
         "short_url": short_url,
-        "qr_code_path": qr_code_path,
+        "qr_code_path": qr_path,
         "original_url": url_data.original_url
     }
 
+@router.post("/shorten/bulk")
+async def shorten_urls_bulk(
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Shorten many URLs at once. Results come back in input order, with an
+    error entry for every item that could not be shortened.
+    """
+    items = await _read_bulk_items(request)
+    if len(items) > BULK_SHORTEN_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail={"message": {
+                "en": f"At most {BULK_SHORTEN_MAX} URLs per request",
+                "tr": f"İstek başına en fazla {BULK_SHORTEN_MAX} URL"
+            }}
+        )
+    
+    results = [None] * len(items)
+    valid = []
+    for index, original_url in enumerate(items):
+        if original_url and original_url.startswith(('http://', 'https://')):
+            valid.append(index)
+        else:
+            results[index] = {
+                "index": index,
+                "original_url": original_url,
+                "error": i18n.get_bilingual_response("invalid_url")
+            }
+    
+    for start in range(0, len(valid), BULK_INSERT_CHUNK):
+        chunk = valid[start:start + BULK_INSERT_CHUNK]
+        inserted = await insert_urls(db, [
+            {"user_id": current_user.id, "original_url": items[index]}
+            for index in chunk
+        ])
+        await record_links_created(db, current_user.id, len(inserted))
+        await db.commit()
+        
+        # Cache the whole chunk in one pipelined round trip
+        await cache_urls(redis_client, {
+            row["short_code"]: CachedURL(row["id"], row["original_url"], False)
+            for row in inserted
+        })
+        await announce_created(redis_client, [row["short_code"] for row in inserted])
+        
+        for index, row in zip(chunk, inserted):
+            results[index] = {
+                "index": index,
+                "original_url": row["original_url"],
+                "short_code": row["short_code"],
+                "short_url": f"{BASE_URL}/{row['short_code']}",
+                "qr_code_path": qr_code_path(row["short_code"])
+            }
+    
+    return {
+        "message": i18n.get_bilingual_response("link_created"),
+        "created": len(valid),
+        "failed": len(items) - len(valid),
+        "results": results
+    }
+
 @router.get("/stats/{short_code}")
 async def get_stats(
     short_code: str,
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    url_record = db.query(URL).filter(
+    url_record = await db.scalar(select(URL).where(
         URL.short_code == short_code,
         URL.user_id == current_user.id
-    ).first()
+    ))
     
     if not url_record:
         raise HTTPException(
@@ -112,60 +226,180 @@ async def get_stats(
             detail={"message": i18n.get_bilingual_response("link_not_found")}
         )
     
-    # Get visit statistics
-    visits = db.query(URLVisit).filter(URLVisit.url_id == url_record.id).all()
+    # Country and daily totals come from the rollup, never from raw visits
+    range_filters = [URLDailyStat.url_id == url_record.id]
+    if start:
+        range_filters.append(URLDailyStat.day >= start)
+    if end:
+        range_filters.append(URLDailyStat.day <= end)
     
-    # Group visits by country
-    country_stats = {}
-    for visit in visits:
-        country = visit.country or "Unknown"
-        country_stats[country] = country_stats.get(country, 0) + 1
+    country_rows = await db.execute(
+        select(URLDailyStat.country, func.sum(URLDailyStat.clicks))
+        .where(*range_filters)
+        .group_by(URLDailyStat.country)
+    )
+    country_stats = {country: int(clicks) for country, clicks in country_rows}
+    
+    daily_rows = await db.execute(
+        select(URLDailyStat.day, func.sum(URLDailyStat.clicks))
+        .where(*range_filters)
+        .group_by(URLDailyStat.day)
+        .order_by(URLDailyStat.day)
+    )
+    daily_rows = daily_rows.all()
+    
+    # Unique visitors come from the daily HyperLogLogs of the days with clicks
+    daily_uniques, unique_visitors = await count_unique_visitors(
+        redis_client, url_record.id, [day for day, _ in daily_rows]
+    )
+    daily_clicks = [
+        {"day": day, "clicks": int(clicks), "unique_visitors": daily_uniques[day]}
+        for day, clicks in daily_rows
+    ]
+    
+    # Last 10 visits via the (url_id, created_at, id) index
+    recent_visits = await db.execute(
+        select(URLVisit.country, URLVisit.created_at, URLVisit.ip_address)
+        .where(URLVisit.url_id == url_record.id)
+        .order_by(URLVisit.created_at.desc())
+        .limit(10)
+    )
     
     return {
         "short_code": short_code,
         "original_url": url_record.original_url,
         "click_count": url_record.click_count,
         "created_at": url_record.created_at,
-        "qr_code_path": url_record.qr_code_path,
+        "qr_code_path": url_record.qr_code_path or qr_code_path(short_code),
+        "unique_visitors": unique_visitors,
         "country_stats": country_stats,
+        "daily_clicks": daily_clicks,
         "recent_visits": [
             {
                 "country": visit.country,
                 "created_at": visit.created_at,
-                "ip_address": visit.ip_address[:8] + "***"  # Anonymize IP
+                "ip_address": (visit.ip_address or "")[:8] + "***"  # Anonymize IP
+            }
+            for visit in recent_visits
+        ]
+    }
+
+@router.get("/visits/export")
+async def export_visits(
+    short_code: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream the click log of one link, or of every link the user owns, as CSV
+    or NDJSON, optionally gzip-compressed. IP addresses are anonymized.
+    """
+    
+    filters = [URL.user_id == current_user.id, *visit_filters(start, end)]
+    if short_code:
+        url_id = await db.scalar(select(URL.id).where(
+            URL.short_code == short_code,
+            URL.user_id == current_user.id
+        ))
+        if url_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail={"message": i18n.get_bilingual_response("link_not_found")}
+            )
+        filters.append(URLVisit.url_id == url_id)
+    
+    filename = export_filename(short_code or "all", format, gzip)
+    return StreamingResponse(
+        stream_visits(filters, format, gzip, anonymize_ip=True),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+URL_FIELDS = {
+    "short_code": ((URL.short_code,), lambda row: row.short_code),
+    "original_url": ((URL.original_url,), lambda row: row.original_url),
+    "short_url": ((URL.short_code,), lambda row: f"{BASE_URL}/{row.short_code}"),
+    "click_count": ((URL.click_count,), lambda row: row.click_count),
+    "created_at": ((URL.created_at,), lambda row: row.created_at),
+    "qr_code_path": (
+        (URL.short_code, URL.qr_code_path),
+        lambda row: row.qr_code_path or qr_code_path(row.short_code)
+    ),
+}
+
+@router.get("/trending")
+async def get_trending(
+    window: int = Query(TRENDING_DEFAULT_WINDOW, ge=1, le=TRENDING_MAX_WINDOW),
+    limit: int = Query(10, ge=1, le=100),
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    The user's most clicked links over the last window minutes
+    """
+    
+    ranked = await top_trending(redis_client, window, limit, current_user.id)
+    urls = {
+        row.id: row for row in await db.execute(
+            select(URL.id, URL.short_code, URL.original_url)
+            .where(URL.id.in_([url_id for url_id, _ in ranked]), URL.user_id == current_user.id)
+        )
+    }
+    
+    return {
+        "window_minutes": window,
+        "data": [
+            {
+                "short_code": urls[url_id].short_code,
+                "short_url": f"{BASE_URL}/{urls[url_id].short_code}",
+                "original_url": urls[url_id].original_url,
+                "clicks": clicks
             }
-            for visit in visits[-10:]  # Last 10 visits
+            for url_id, clicks in ranked if url_id in urls
         ]
     }
 
 @router.get("/urls")
 async def get_user_urls(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all URLs created by the current user"""
-    urls = db.query(URL).filter(URL.user_id == current_user.id).order_by(URL.created_at.desc()).all()
-    
-    return [
-        {
-            "short_code": url.short_code,
-            "original_url": url.original_url,
-            "short_url": f"{BASE_URL}/{url.short_code}",
-            "click_count": url.click_count,
-            "created_at": url.created_at,
-            "qr_code_path": url.qr_code_path
-        }
-        for url in urls
-    ]
+    """Get the current user's URLs, newest first. Without cursor or limit every
+    URL is returned; otherwise one keyset page at a time, with the cursor for
+    the next page in the X-Next-Cursor header."""
+    names = parse_fields(fields, URL_FIELDS)
+    limit = page_size(cursor, limit)
+    rows = (await db.execute(keyset_page(
+        select(*projection(URL_FIELDS, names, URL.id, URL.created_at))
+        .where(URL.user_id == current_user.id),
+        URL.created_at, URL.id, cursor, limit
+    ))).all()
+    
+    rows, next_cursor = split_page(rows, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    
+    return [render(row, URL_FIELDS, names) for row in rows]
+
 @router.get("/warnings")
 async def get_user_warnings(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all warnings for the current user"""
-    warnings = db.query(UserWarning).filter(
-        UserWarning.user_id == current_user.id
-    ).order_by(UserWarning.created_at.desc()).all()
+    warnings = (await db.scalars(
+        select(UserWarning).where(
+            UserWarning.user_id == current_user.id
+        ).order_by(UserWarning.created_at.desc())
+    )).all()
     
     result = []
     for warning in warnings:
@@ -178,7 +412,7 @@ async def get_user_warnings(
         }
         
         if warning.url_id:
-            url = db.query(URL).filter(URL.id == warning.url_id).first()
+            url = await db.scalar(select(URL).where(URL.id == warning.url_id))
             if url:
                 warning_data["url"] = {
                     "short_code": url.short_code,
@@ -193,14 +427,14 @@ async def get_user_warnings(
 @router.post("/warnings/{warning_id}/mark-read")
 async def mark_warning_read(
     warning_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Mark a warning as read"""
-    warning = db.query(UserWarning).filter(
+    warning = await db.scalar(select(UserWarning).where(
         UserWarning.id == warning_id,
         UserWarning.user_id == current_user.id
-    ).first()
+    ))
     
     if not warning:
         raise HTTPException(
@@ -209,6 +443,6 @@ async def mark_warning_read(
         )
     
     warning.is_read = True
-    db.commit()
+    await db.commit()
     
     return {"message": {"en": "Warning marked as read", "tr": "Uyarı okundu olarak işaretlendi"}}
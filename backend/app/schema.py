@@ -0,0 +1,37 @@
+"""
+One-time database preparation: create missing tables and the url_visits
+partitions. Runs before workers start (gunicorn's on_starting hook, or
+`python -m app.schema`), never at import time in a serving worker.
+"""
+
+import logging
+import os
+import time
+
+from .database import engine, Base
+from .utils.partitions import ensure_partitions, ensure_visit_indexes
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SETUP_RETRIES = int(os.getenv("SCHEMA_SETUP_RETRIES", "30"))
+SCHEMA_SETUP_RETRY_DELAY = float(os.getenv("SCHEMA_SETUP_RETRY_DELAY", "2"))
+
+def prepare_database(max_retries: int = SCHEMA_SETUP_RETRIES, delay: float = SCHEMA_SETUP_RETRY_DELAY) -> None:
+    """Wait for the database, then create the schema."""
+    for attempt in range(1, max_retries + 1):
+        try:
+            Base.metadata.create_all(bind=engine)
+            with engine.begin() as conn:
+                ensure_partitions(conn)
+                ensure_visit_indexes(conn)
+            logger.info("Database schema ready")
+            return
+        except Exception:
+            logger.info(f"Database not ready, retrying... ({attempt}/{max_retries})")
+            time.sleep(delay)
+    raise Exception("Database connection failed")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    prepare_database()
+    engine.dispose()
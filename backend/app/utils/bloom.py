@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import math
+import os
+import time
+
+from sqlalchemy import select
+
+from ..database import AsyncSessionLocal, URL
+
+logger = logging.getLogger(__name__)
+
+# Expected number of short codes and acceptable false-positive rate
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "10000000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.01"))
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        # Until the initial scan finishes every code must be treated as possibly present
+        self.ready = False
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def reset(self) -> None:
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
+        self.ready = False
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+        if self.count == self.capacity + 1:
+            logger.warning("Short code Bloom filter is over capacity; raise BLOOM_CAPACITY")
+
+    def might_contain(self, key: str) -> bool:
+        if not self.ready:
+            return True
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+short_code_filter = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+
+async def build_short_code_filter() -> None:
+    """Load every existing short code through a server-side cursor. Must run after
+    the worker is subscribed to creation messages so no new code is missed."""
+    started = time.monotonic()
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.stream_scalars(
+                select(URL.short_code).execution_options(yield_per=10000)
+            )
+            async for short_code in result:
+                if short_code:
+                    short_code_filter.add(short_code)
+    except Exception:
+        logger.exception("Could not build the short code Bloom filter; lookups will skip it")
+        return
+    short_code_filter.ready = True
+    logger.info(f"Short code Bloom filter built with {short_code_filter.count} codes in {time.monotonic() - started:.1f}s")
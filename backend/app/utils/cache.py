@@ -0,0 +1,417 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import redis
+from redis.exceptions import LockError
+from sqlalchemy import select
+
+from ..database import AsyncSessionLocal, URL, User
+from .auth import ACCESS_TOKEN_EXPIRE_MINUTES
+from .bloom import short_code_filter, build_short_code_filter
+from .metrics import REDIRECT_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Seconds a short code stays in Redis after it was last (re)cached
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", "3600"))
+# Fraction of URL_CACHE_TTL randomly shaved off each write so keys cached together expire apart
+URL_CACHE_TTL_JITTER = float(os.getenv("URL_CACHE_TTL_JITTER", "0.1"))
+# Probabilistic early refresh (XFetch): roughly the seconds before expiry at which
+# hot keys start being refreshed in the background while still being served
+URL_CACHE_EARLY_REFRESH = float(os.getenv("URL_CACHE_EARLY_REFRESH", "10"))
+
+# Cross-worker lock held while one request repopulates a missing key
+URL_REFILL_LOCK_TTL = float(os.getenv("URL_REFILL_LOCK_TTL", "5"))
+# How long other workers wait for the lock holder before querying Postgres themselves
+URL_REFILL_WAIT = float(os.getenv("URL_REFILL_WAIT", "1.0"))
+URL_REFILL_POLL_INTERVAL = 0.02
+
+# Per-worker L1 cache in front of Redis
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "10000"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "30"))
+
+# Seconds an unknown short code is remembered as missing
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "60"))
+# Value stored under url:{short_code} for codes known not to exist
+NEGATIVE_MARKER = "-"
+
+# Seconds a verified user's identity stays in Redis; a token lives this long
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", str(ACCESS_TOKEN_EXPIRE_MINUTES * 60)))
+
+# Pub/sub channel carrying short codes whose cached record changed
+INVALIDATION_CHANNEL = "url:invalidate"
+# Pub/sub channel carrying usernames whose cached identity changed
+USER_INVALIDATION_CHANNEL = "user:invalidate"
+# Pub/sub channel carrying space-separated batches of newly created short codes
+CREATED_CHANNEL = "url:created"
+# Seconds between retries of creation announcements that could not be published
+CREATED_RETRY_INTERVAL = 1.0
+# Seconds between full Bloom filter rebuilds from Postgres, a backstop for any
+# creation announcement a worker never received; 0 disables
+BLOOM_REBUILD_INTERVAL = float(os.getenv("BLOOM_REBUILD_INTERVAL", "3600"))
+
+class CachedURL(NamedTuple):
+    url_id: int
+    original_url: str
+    is_flagged: bool
+    expires_at: Optional[str] = None
+
+class CachedUser(NamedTuple):
+    """What request handlers need to know about an authenticated user."""
+    id: int
+    username: str
+    is_admin: bool
+    is_active: bool
+    preferred_language: Optional[str]
+
+class LRUCache:
+    """Thread-safe bounded LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+l1_cache = LRUCache(L1_CACHE_SIZE, L1_CACHE_TTL)
+user_l1_cache = LRUCache(L1_CACHE_SIZE, L1_CACHE_TTL)
+
+# L1 value for short codes known not to exist
+MISSING = object()
+
+_filter_build: Optional[asyncio.Task] = None
+
+# New short codes whose announcement failed; republished until Redis takes them
+_unannounced: List[str] = []
+
+# Short code -> in-progress refill shared by every request of this worker
+_inflight: Dict[str, asyncio.Future] = {}
+# Short codes with an early refresh running. Kept apart from _inflight because
+# a refresh gives up (returns None) when another worker holds the lock, which
+# a waiting miss would take for "not found"
+_refreshing: Set[str] = set()
+
+def url_cache_key(short_code: str) -> str:
+    return f"url:{short_code}"
+
+def user_cache_key(username: str) -> str:
+    return f"user:{username}"
+
+def refill_lock_key(short_code: str) -> str:
+    return f"url-refill:{short_code}"
+
+def cache_ttl() -> int:
+    return max(1, int(URL_CACHE_TTL * (1 - random.random() * URL_CACHE_TTL_JITTER)))
+
+def to_cached(url) -> CachedURL:
+    return CachedURL(url.id, url.original_url, bool(url.is_flagged), getattr(url, "expires_at", None))
+
+def pack_url(record: CachedURL) -> str:
+    """Serialize a record into the compact value stored under url:{short_code}."""
+    return json.dumps(list(record), separators=(",", ":"))
+
+def unpack_url(raw: Optional[str]) -> Optional[CachedURL]:
+    """Decode a cached record; legacy plain-URL values are treated as a miss."""
+    if not raw or raw[0] != "[":
+        return None
+    try:
+        return CachedURL(*json.loads(raw))
+    except (ValueError, TypeError):
+        return None
+
+async def cache_url(redis_client, url) -> CachedURL:
+    """Store the compact record for a URL row and return it."""
+    record = to_cached(url)
+    await redis_client.setex(url_cache_key(url.short_code), cache_ttl(), pack_url(record))
+    return record
+
+async def resolve_url(redis_client, short_code: str) -> Optional[CachedURL]:
+    """Look a short code up in the L1, the Bloom filter, Redis, then Postgres,
+    filling the caches on the way back. Unknown codes are cached as missing."""
+    cached = l1_cache.get(short_code)
+    if cached is not None:
+        REDIRECT_CACHE.labels("l1_negative" if cached is MISSING else "l1_hit").inc()
+        return None if cached is MISSING else cached
+
+    # Definitely unknown codes are rejected without any network I/O
+    if not short_code_filter.might_contain(short_code):
+        REDIRECT_CACHE.labels("bloom_reject").inc()
+        return None
+
+    key = url_cache_key(short_code)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(key)
+        pipe.ttl(key)
+        raw, ttl = await pipe.execute()
+    if raw == NEGATIVE_MARKER:
+        REDIRECT_CACHE.labels("redis_negative").inc()
+        l1_cache.set(short_code, MISSING)
+        return None
+
+    cached = unpack_url(raw)
+    if cached is None:
+        cached = await _refill(redis_client, short_code)
+        REDIRECT_CACHE.labels("miss" if cached is not None else "miss_negative").inc()
+        if cached is None:
+            l1_cache.set(short_code, MISSING)
+            return None
+    else:
+        REDIRECT_CACHE.labels("redis_hit").inc()
+        if _refresh_early(ttl):
+            _refresh_in_background(redis_client, short_code)
+
+    l1_cache.set(short_code, cached)
+    return cached
+
+def _refresh_early(ttl: int) -> bool:
+    """XFetch: the closer a key is to expiring, the likelier a request refreshes it."""
+    if ttl < 0 or URL_CACHE_EARLY_REFRESH <= 0:
+        return False
+    return -URL_CACHE_EARLY_REFRESH * math.log(1.0 - random.random()) >= ttl
+
+async def _refill(redis_client, short_code: str) -> Optional[CachedURL]:
+    """Repopulate a missing key; concurrent misses in this worker share one load."""
+    future = _inflight.get(short_code)
+    if future is None:
+        future = asyncio.ensure_future(_load_locked(redis_client, short_code, wait=True))
+        _inflight[short_code] = future
+        future.add_done_callback(lambda _: _inflight.pop(short_code, None))
+    return await asyncio.shield(future)
+
+def _refresh_in_background(redis_client, short_code: str) -> None:
+    if short_code in _refreshing or short_code in _inflight:
+        return
+    future = asyncio.ensure_future(_load_locked(redis_client, short_code, wait=False))
+    _refreshing.add(short_code)
+    future.add_done_callback(lambda done: _finish_refresh(short_code, done))
+
+def _finish_refresh(short_code: str, future: asyncio.Future) -> None:
+    _refreshing.discard(short_code)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Background refresh of {short_code} failed: {future.exception()}")
+
+async def _load_locked(redis_client, short_code: str, wait: bool) -> Optional[CachedURL]:
+    """Load from Postgres under a short Redis lock so only one worker hits the
+    database per key. Without the lock, either give up (background refresh,
+    the current value is still served) or wait for the holder's result."""
+    lock = redis_client.lock(refill_lock_key(short_code), timeout=URL_REFILL_LOCK_TTL)
+    if await lock.acquire(blocking=False):
+        try:
+            return await _load(redis_client, short_code)
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+    if not wait:
+        return None
+
+    key = url_cache_key(short_code)
+    deadline = time.monotonic() + URL_REFILL_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(URL_REFILL_POLL_INTERVAL)
+        raw = await redis_client.get(key)
+        if raw == NEGATIVE_MARKER:
+            return None
+        cached = unpack_url(raw)
+        if cached is not None:
+            return cached
+    # The holder is slow or gone; serve this request from Postgres anyway
+    return await _load(redis_client, short_code)
+
+async def _load(redis_client, short_code: str) -> Optional[CachedURL]:
+    async with AsyncSessionLocal() as db:
+        url_record = await db.scalar(select(URL).where(URL.short_code == short_code))
+    if not url_record:
+        await redis_client.set(url_cache_key(short_code), NEGATIVE_MARKER, ex=NEGATIVE_CACHE_TTL, nx=True)
+        return None
+    return await cache_url(redis_client, url_record)
+
+async def cache_urls(redis_client, records: Dict[str, CachedURL]) -> None:
+    """Store many short code -> record entries in one pipelined round trip."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for short_code, record in records.items():
+            pipe.setex(url_cache_key(short_code), cache_ttl(), pack_url(record))
+        await pipe.execute()
+
+async def invalidate_url(redis_client, short_code: str) -> None:
+    """Drop a short code from this worker's L1 and tell every other worker to do the same."""
+    l1_cache.pop(short_code)
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, short_code)
+    except redis.RedisError as e:
+        # Other workers fall back to the L1 TTL
+        logger.warning(f"Could not publish invalidation for {short_code}: {e}")
+
+async def resolve_user(redis_client, db, username: str) -> Optional[CachedUser]:
+    """Look a token's username up in the L1, then Redis, then Postgres."""
+    cached = user_l1_cache.get(username)
+    if cached is not None:
+        return cached
+
+    raw = await redis_client.get(user_cache_key(username))
+    try:
+        cached = CachedUser(*json.loads(raw)) if raw else None
+    except (ValueError, TypeError):
+        cached = None
+
+    if cached is None:
+        row = (await db.execute(
+            select(User.id, User.username, User.is_admin, User.is_active, User.preferred_language)
+            .where(User.username == username)
+        )).first()
+        if row is None:
+            return None
+        cached = CachedUser(row.id, row.username, bool(row.is_admin), bool(row.is_active), row.preferred_language)
+        await redis_client.setex(
+            user_cache_key(username), USER_CACHE_TTL, json.dumps(list(cached), separators=(",", ":"))
+        )
+
+    user_l1_cache.set(username, cached)
+    return cached
+
+async def invalidate_user(redis_client, username: str) -> None:
+    """Forget a user's cached identity everywhere; call after changing the user's row."""
+    user_l1_cache.pop(username)
+    await redis_client.delete(user_cache_key(username))
+    try:
+        await redis_client.publish(USER_INVALIDATION_CHANNEL, username)
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish invalidation for user {username}: {e}")
+
+async def announce_created(redis_client, short_codes: Iterable[str]) -> None:
+    """Add new codes to this worker's Bloom filter (dropping any cached miss)
+    and tell every other worker to do the same."""
+    short_codes = list(short_codes)
+    _apply_created(short_codes)
+    try:
+        await redis_client.publish(CREATED_CHANNEL, " ".join(short_codes))
+    except redis.RedisError as e:
+        # Other workers' filters would reject these codes with no TTL to end
+        # it, so keep them until the filter maintainer gets them published
+        _unannounced.extend(short_codes)
+        logger.warning(f"Could not publish {len(short_codes)} created short codes, will retry: {e}")
+
+def _apply_created(short_codes: Iterable[str]) -> None:
+    for short_code in short_codes:
+        short_code_filter.add(short_code)
+        l1_cache.pop(short_code)
+
+def _rebuild_filter() -> None:
+    """(Re)load the Bloom filter; called once subscribed so no creation is missed."""
+    global _filter_build
+    if _filter_build is not None and not _filter_build.done():
+        _filter_build.cancel()
+    short_code_filter.reset()
+    _filter_build = asyncio.create_task(build_short_code_filter(), name="bloom-build")
+
+async def _listen_for_invalidations(redis_client) -> None:
+    while True:
+        try:
+            async with redis_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL, CREATED_CHANNEL, USER_INVALIDATION_CHANNEL)
+                # Messages may have been missed while disconnected
+                l1_cache.clear()
+                user_l1_cache.clear()
+                _rebuild_filter()
+                async for message in pubsub.listen():
+                    if message["channel"] == CREATED_CHANNEL:
+                        _apply_created(message["data"].split())
+                    elif message["channel"] == USER_INVALIDATION_CHANNEL:
+                        user_l1_cache.pop(message["data"])
+                    else:
+                        l1_cache.pop(message["data"])
+        except redis.RedisError as e:
+            logger.warning(f"L1 invalidation listener lost Redis, retrying: {e}")
+            await asyncio.sleep(1)
+
+def start_invalidation_listener(redis_client) -> asyncio.Task:
+    """Start the per-worker task that applies invalidations and creations from other workers."""
+    return asyncio.create_task(_listen_for_invalidations(redis_client), name="l1-invalidation")
+
+async def _republish_created(redis_client) -> None:
+    pending = list(_unannounced)
+    try:
+        await redis_client.publish(CREATED_CHANNEL, " ".join(pending))
+    except redis.RedisError as e:
+        logger.warning(f"Still cannot publish {len(pending)} created short codes: {e}")
+        return
+    del _unannounced[:len(pending)]
+
+async def _maintain_filter(redis_client) -> None:
+    next_rebuild = time.monotonic() + BLOOM_REBUILD_INTERVAL
+    while True:
+        await asyncio.sleep(CREATED_RETRY_INTERVAL)
+        if _unannounced:
+            await _republish_created(redis_client)
+        if BLOOM_REBUILD_INTERVAL > 0 and time.monotonic() >= next_rebuild:
+            next_rebuild = time.monotonic() + BLOOM_REBUILD_INTERVAL
+            _rebuild_filter()
+
+def start_filter_maintainer(redis_client) -> asyncio.Task:
+    """Start the per-worker task that retries failed creation announcements
+    and periodically rebuilds the Bloom filter from Postgres."""
+    return asyncio.create_task(_maintain_filter(redis_client), name="bloom-maintenance")
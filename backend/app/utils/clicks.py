@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from ..database import AsyncSessionLocal, URL, URLVisit, URLDailyStat
+from .counters import record_clicks
+from .metrics import CLICKS_WRITTEN, QUEUE_DEPTH
+from .redis_client import redis_client
+from .trending import record_trending
+from .uniques import record_visitors
+
+logger = logging.getLogger(__name__)
+
+# Max visits written per transaction
+CLICK_FLUSH_SIZE = int(os.getenv("CLICK_FLUSH_SIZE", "500"))
+# Max seconds a visit waits in the queue before being written
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0"))
+# Pending visits per worker before redirects start waiting on the flusher
+CLICK_QUEUE_SIZE = int(os.getenv("CLICK_QUEUE_SIZE", "20000"))
+
+class ClickIngestor:
+    """Buffers redirect visits in a bounded queue and writes them in batches:
+    one multi-row INSERT into url_visits, one click_count update per URL and
+    one upsert into the url_daily_stats rollup and the dashboard counters.
+    Visitors then go into per-link daily HyperLogLogs and per-minute trending
+    buckets in Redis."""
+
+    def __init__(self, flush_size: int, flush_interval: float, queue_size: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still queued and stop the flusher."""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._task
+        self._task = None
+
+    async def record(self, url_id: int, ip_address: str, country: str, user_agent: str) -> None:
+        """Queue a visit; waits (backpressure) only when the queue is full."""
+        await self._queue.put({
+            "url_id": url_id,
+            "ip_address": ip_address,
+            "country": country,
+            "user_agent": user_agent,
+            "created_at": datetime.now(timezone.utc)
+        })
+        self.enqueued += 1
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self) -> None:
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._next_batch()
+            QUEUE_DEPTH.labels("clicks").set(self.depth())
+            if not batch:
+                continue
+            try:
+                owners = await self._write(batch)
+                self.flushed += len(batch)
+                CLICKS_WRITTEN.labels("written").inc(len(batch))
+            except Exception:
+                self.failed += len(batch)
+                CLICKS_WRITTEN.labels("failed").inc(len(batch))
+                logger.exception(f"Failed to write {len(batch)} visits")
+                continue
+            try:
+                await record_visitors(redis_client, batch)
+                await record_trending(redis_client, batch, owners)
+            except Exception as e:
+                # Unique counts and trends are estimates; a lost batch only undercounts them
+                logger.warning(f"Could not record unique visitors or trends for {len(batch)} visits: {e}")
+
+    async def _next_batch(self) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            batch = [await asyncio.wait_for(self._queue.get(), self.flush_interval)]
+        except asyncio.TimeoutError:
+            return []
+
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self._stopping:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[dict]) -> Dict[int, Optional[int]]:
+        """Write a batch; returns the owner of every link whose visits were kept."""
+        async with AsyncSessionLocal() as db:
+            try:
+                return await self._write_batch(db, batch)
+            except IntegrityError:
+                # A link was deleted while its visits were queued; drop those and retry
+                await db.rollback()
+                url_ids = {visit["url_id"] for visit in batch}
+                existing = set(await db.scalars(select(URL.id).where(URL.id.in_(url_ids))))
+                batch = [visit for visit in batch if visit["url_id"] in existing]
+                if batch:
+                    return await self._write_batch(db, batch)
+                return {}
+
+    async def _write_batch(self, db, batch: List[dict]) -> Dict[int, Optional[int]]:
+        urls = URL.__table__
+        counts = Counter(visit["url_id"] for visit in batch)
+        await db.execute(insert(URLVisit.__table__).values(batch))
+        # Fixed lock order so concurrent workers cannot deadlock on urls rows
+        clicks_by_user = Counter()
+        owners = {}
+        for url_id in sorted(counts):
+            owners[url_id] = user_id = await db.scalar(
+                update(urls)
+                .where(urls.c.id == url_id)
+                .values(click_count=urls.c.click_count + counts[url_id])
+                .returning(urls.c.user_id)
+            )
+            clicks_by_user[user_id] += counts[url_id]
+        await record_clicks(db, clicks_by_user)
+
+        rollup = URLDailyStat.__table__
+        daily = Counter(
+            (visit["url_id"], visit["created_at"].date(), visit["country"] or "Unknown")
+            for visit in batch
+        )
+        stmt = pg_insert(rollup).values([
+            {"url_id": url_id, "day": day, "country": country, "clicks": clicks}
+            for (url_id, day, country), clicks in sorted(daily.items())
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[rollup.c.url_id, rollup.c.day, rollup.c.country],
+            set_={"clicks": rollup.c.clicks + stmt.excluded.clicks}
+        ))
+        await db.commit()
+        return owners
+
+click_ingestor = ClickIngestor(CLICK_FLUSH_SIZE, CLICK_FLUSH_INTERVAL, CLICK_QUEUE_SIZE)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Dict, Optional
+
+from sqlalchemy import delete, select, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..database import AsyncSessionLocal, User, URL, UserStat, SiteStat
+
+logger = logging.getLogger(__name__)
+
+# Seconds between full recomputations of the dashboard counters
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+# Only one worker reconciles per interval
+RECONCILE_LOCK_KEY = "stats:reconcile:lock"
+# site_stats rows the global totals are spread over; readers sum them
+SITE_STAT_SLOTS = int(os.getenv("SITE_STAT_SLOTS", "16"))
+
+def _site_slot(db) -> int:
+    """A random site_stats row per session, so concurrent writers rarely wait
+    on each other's row lock and one transaction never locks two rows."""
+    return db.info.setdefault("site_stat_slot", random.randrange(SITE_STAT_SLOTS))
+
+async def _bump_site(db, users: int = 0, urls: int = 0, clicks: int = 0) -> None:
+    site = SiteStat.__table__
+    stmt = pg_insert(site).values(id=_site_slot(db), total_users=users, total_urls=urls, total_clicks=clicks)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[site.c.id],
+        set_={
+            "total_users": site.c.total_users + stmt.excluded.total_users,
+            "total_urls": site.c.total_urls + stmt.excluded.total_urls,
+            "total_clicks": site.c.total_clicks + stmt.excluded.total_clicks
+        }
+    ))
+
+async def _bump_users(db, deltas: Dict[int, tuple]) -> None:
+    """Add (url_count, total_clicks) deltas to each user's row."""
+    if not deltas:
+        return
+    stats = UserStat.__table__
+    stmt = pg_insert(stats).values([
+        {"user_id": user_id, "url_count": urls, "total_clicks": clicks}
+        for user_id, (urls, clicks) in sorted(deltas.items())
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[stats.c.user_id],
+        set_={
+            "url_count": stats.c.url_count + stmt.excluded.url_count,
+            "total_clicks": stats.c.total_clicks + stmt.excluded.total_clicks
+        }
+    ))
+
+async def record_user_created(db, user_id: int) -> None:
+    await _bump_users(db, {user_id: (0, 0)})
+    await _bump_site(db, users=1)
+
+async def record_links_created(db, user_id: Optional[int], count: int = 1) -> None:
+    if user_id is not None:
+        await _bump_users(db, {user_id: (count, 0)})
+    await _bump_site(db, urls=count)
+
+async def record_link_deleted(db, user_id: Optional[int], clicks: int) -> None:
+    if user_id is not None:
+        await _bump_users(db, {user_id: (-1, -clicks)})
+    await _bump_site(db, urls=-1, clicks=-clicks)
+
+async def record_clicks(db, clicks_by_user: Dict[Optional[int], int]) -> None:
+    """Apply one flush worth of clicks; anonymous links only count globally."""
+    await _bump_users(db, {
+        user_id: (0, clicks) for user_id, clicks in clicks_by_user.items() if user_id is not None
+    })
+    await _bump_site(db, clicks=sum(clicks_by_user.values()))
+
+async def site_totals(db) -> Dict[str, int]:
+    """Global dashboard totals, summed over every site_stats slot."""
+    row = (await db.execute(select(
+        func.coalesce(func.sum(SiteStat.total_users), 0).label("total_users"),
+        func.coalesce(func.sum(SiteStat.total_urls), 0).label("total_urls"),
+        func.coalesce(func.sum(SiteStat.total_clicks), 0).label("total_clicks")
+    ))).one()
+    return dict(row._mapping)
+
+async def reconcile(db) -> None:
+    """Recompute every counter from users and urls, correcting any drift."""
+    stats = UserStat.__table__
+    totals = select(
+        User.id,
+        func.count(URL.id),
+        func.coalesce(func.sum(URL.click_count), 0)
+    ).join(URL, User.id == URL.user_id, isouter=True)\
+     .where(User.is_admin == False)\
+     .group_by(User.id)
+    stmt = pg_insert(stats).from_select(["user_id", "url_count", "total_clicks"], totals)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[stats.c.user_id],
+        set_={"url_count": stmt.excluded.url_count, "total_clicks": stmt.excluded.total_clicks}
+    ))
+
+    # The recomputed totals go into slot 0 and every other slot starts again from zero
+    site = SiteStat.__table__
+    await db.execute(delete(site).where(site.c.id != 0))
+    stmt = pg_insert(site).from_select(
+        ["id", "total_users", "total_urls", "total_clicks"],
+        select(
+            literal(0),
+            select(func.count(User.id)).where(User.is_admin == False).scalar_subquery(),
+            select(func.count(URL.id)).scalar_subquery(),
+            select(func.coalesce(func.sum(URL.click_count), 0)).scalar_subquery()
+        )
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[site.c.id],
+        set_={
+            "total_users": stmt.excluded.total_users,
+            "total_urls": stmt.excluded.total_urls,
+            "total_clicks": stmt.excluded.total_clicks
+        }
+    ))
+    await db.commit()
+
+async def _reconcile_periodically(redis_client) -> None:
+    while True:
+        try:
+            # Lock lives for most of the interval so other workers skip this round
+            if await redis_client.set(RECONCILE_LOCK_KEY, os.getpid(), nx=True, ex=max(1, int(STATS_RECONCILE_INTERVAL * 0.9))):
+                async with AsyncSessionLocal() as db:
+                    await reconcile(db)
+                logger.info("Reconciled dashboard counters")
+        except Exception:
+            logger.exception("Dashboard counter reconciliation failed")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+def start_reconciler(redis_client) -> asyncio.Task:
+    """Start the per-worker task that periodically reconciles the dashboard counters."""
+    return asyncio.create_task(_reconcile_periodically(redis_client), name="stats-reconcile")
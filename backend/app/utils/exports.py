@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import select
+
+from ..database import AsyncSessionLocal, URL, URLVisit
+
+# Rows fetched per server-side cursor round trip; also the rows per emitted chunk
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "5000"))
+# zlib level used when a compressed export is requested
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+VISIT_EXPORT_COLUMNS = ("visit_id", "short_code", "created_at", "country", "ip_address", "user_agent")
+
+def visit_filters(start: Optional[datetime], end: Optional[datetime]) -> List:
+    """Time-range filters on url_visits.created_at; both bounds let Postgres prune partitions."""
+    filters = []
+    if start:
+        filters.append(URLVisit.created_at >= start)
+    if end:
+        filters.append(URLVisit.created_at < end)
+    return filters
+
+def export_filename(scope: str, fmt: str, compress: bool) -> str:
+    return f"visits-{scope}.{fmt}" + (".gz" if compress else "")
+
+def _anonymize(ip_address: Optional[str]) -> str:
+    return (ip_address or "")[:8] + "***"
+
+def _encode_rows(rows, fmt: str, anonymize_ip: bool, header: bool) -> str:
+    records = [
+        (
+            row.id,
+            row.short_code,
+            row.created_at.isoformat(),
+            row.country,
+            _anonymize(row.ip_address) if anonymize_ip else row.ip_address,
+            row.user_agent
+        )
+        for row in rows
+    ]
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(VISIT_EXPORT_COLUMNS, record)), ensure_ascii=False) + "\n"
+            for record in records
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(VISIT_EXPORT_COLUMNS)
+    writer.writerows(records)
+    return buffer.getvalue()
+
+async def stream_visits(filters: List, fmt: str, compress: bool, anonymize_ip: bool) -> AsyncIterator[bytes]:
+    """
+    Stream matching visits oldest first through a server-side cursor, one
+    encoded (and optionally gzip-compressed) chunk per fetched batch, so
+    memory stays constant however many rows the export covers.
+    """
+
+    stmt = select(
+        URLVisit.id,
+        URL.short_code,
+        URLVisit.created_at,
+        URLVisit.country,
+        URLVisit.ip_address,
+        URLVisit.user_agent
+    ).join(URL, URL.id == URLVisit.url_id)\
+     .where(*filters)\
+     .order_by(URLVisit.created_at, URLVisit.id)\
+     .execution_options(yield_per=EXPORT_YIELD_PER)
+
+    # wbits=31 writes a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    header = fmt == "csv"
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            chunk = _encode_rows(rows, fmt, anonymize_ip, header).encode("utf-8")
+            header = False
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    if header:
+        # No rows at all; a CSV still gets its header line
+        chunk = _encode_rows([], fmt, anonymize_ip, header).encode("utf-8")
+        yield compressor.compress(chunk) if compressor is not None else chunk
+    if compressor is not None:
+        yield compressor.flush()
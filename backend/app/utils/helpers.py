@@ -1,60 +1,98 @@
 import os
-import bcrypt
-import secrets
-import string
-import qrcode
-from PIL import Image
-from io import BytesIO
-import geoip2.database
+import logging
+import threading
+import time
+from functools import lru_cache
 from fastapi import Request
+from .metrics import timed
 
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify a password against its hash."""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-
-def generate_short_code(length: int = 6) -> str:
-    """Generate a random short code."""
-    characters = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(characters) for _ in range(length))
-
-def generate_qr_code(url: str, short_code: str) -> str:
-    """Generate QR code for URL and save it."""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Save QR code
-    qr_dir = os.path.join(os.path.dirname(__file__), "..", "..", "static", "qr")
-    os.makedirs(qr_dir, exist_ok=True)
-    qr_path = os.path.join(qr_dir, f"{short_code}.png")
-    img.save(qr_path)
-    
-    return f"/static/qr/{short_code}.png"
+logger = logging.getLogger(__name__)
+
+GEOIP_DB_PATH = os.getenv(
+    "GEOIP_DB_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "geoip", "GeoLite2-Country.mmdb")
+)
+# Distinct IPs whose country is memoized per process
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "65536"))
+# Seconds between checks for a replaced database file
+GEOIP_RELOAD_INTERVAL = float(os.getenv("GEOIP_RELOAD_INTERVAL", "60"))
+
+class GeoIPReader:
+    """One memory-mapped GeoLite2 reader per process, reopened when the file on disk is replaced."""
+
+    def __init__(self, path: str, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._reader = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            with self._lock:
+                if now - self._checked_at >= self.reload_interval:
+                    self._checked_at = now
+                    self._reload_if_changed()
+        return self._reader
+
+    def _reload_if_changed(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self._stamp is not False:
+                logger.warning(f"GeoIP database not found at {self.path}")
+                self._stamp = False
+            return
+
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+
+        # geoip2 is only imported once a country is actually needed
+        import geoip2.database
+        from maxminddb import MODE_MMAP
+
+        try:
+            reader = geoip2.database.Reader(self.path, mode=MODE_MMAP)
+        except Exception as e:
+            logger.warning(f"Could not open GeoIP database {self.path}: {e}")
+            return
+
+        old, self._reader, self._stamp = self._reader, reader, stamp
+        _lookup_country.cache_clear()
+        if old is not None:
+            old.close()
+            logger.info(f"Reloaded GeoIP database {self.path}")
+
+geoip_reader = GeoIPReader(GEOIP_DB_PATH, GEOIP_RELOAD_INTERVAL)
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def _lookup_country(ip_address: str) -> str:
+    reader = geoip_reader.get()
+    if reader is None:
+        return "Unknown"
+    from geoip2.errors import AddressNotFoundError
+
+    try:
+        return reader.country(ip_address).country.name or "Unknown"
+    except (AddressNotFoundError, ValueError):
+        return "Unknown"
 
 def get_country_from_ip(ip_address: str) -> str:
     """Get country from IP address using GeoIP2."""
+    # Handle localhost and private IPs
+    if ip_address in ['127.0.0.1', 'localhost', '::1'] or ip_address.startswith('192.168.') or ip_address.startswith('10.'):
+        return "Local"
+
+    # Let a replaced database file be picked up even when every IP is cached
     try:
-        # Handle localhost and private IPs
-        if ip_address in ['127.0.0.1', 'localhost', '::1'] or ip_address.startswith('192.168.') or ip_address.startswith('10.'):
-            return "Local"
-        
-        geoip_db = os.path.join(os.path.dirname(__file__), "..", "..", "geoip", "GeoLite2-Country.mmdb")
-        with geoip2.database.Reader(geoip_db) as reader:
-            response = reader.country(ip_address)
-            return response.country.name if response.country.name else "Unknown"
+        with timed("geoip"):
+            geoip_reader.get()
+            return _lookup_country(ip_address)
     except Exception as e:
-        print(f"GeoIP Error: {e}")
+        logger.warning(f"GeoIP Error: {e}")
         return "Unknown"
 
 def get_client_ip(request: Request) -> str:
@@ -64,6 +102,15 @@ def get_client_ip(request: Request) -> str:
         return forwarded.split(",")[0].strip()
     return request.client.host
 
+def get_trusted_client_ip(request: Request) -> str:
+    """Client IP that the client cannot choose: nginx sets X-Real-IP to the
+    connecting address, while the first X-Forwarded-For entry is whatever
+    the client sent. Use this for anything security relevant."""
+    real_ip = request.headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip.strip()
+    return request.client.host
+
 def detect_language(request: Request, user_preference: str = None) -> str:
     """Detect language from user preference or Accept-Language header."""
     if user_preference:
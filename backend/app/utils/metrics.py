@@ -0,0 +1,156 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Set for gunicorn (see gunicorn.conf.py); every worker then writes its samples
+# to files in this directory and /metrics aggregates them
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+_FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route handler",
+    ["method", "handler", "status"]
+)
+DEPENDENCY_TIME = Histogram(
+    "request_dependency_seconds", "Time one request spent waiting on Redis, Postgres or GeoIP",
+    ["dependency", "handler"], buckets=_FAST_BUCKETS
+)
+REDIRECT_CACHE = Counter(
+    "redirect_cache_lookups_total", "Short code lookups by where they were answered", ["result"]
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_seconds", "Time spent obtaining a pooled Postgres connection", buckets=_FAST_BUCKETS
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Postgres connections currently checked out", multiprocess_mode="livesum"
+)
+POOL_CAPACITY = Gauge(
+    "db_pool_capacity", "Postgres connections the pools may open (pool_size + max_overflow)", multiprocess_mode="livesum"
+)
+QUEUE_DEPTH = Gauge(
+    "background_queue_depth", "Items waiting in a per-worker background queue", ["queue"], multiprocess_mode="livesum"
+)
+STARTUP_TIME = Gauge(
+    "worker_startup_seconds", "Seconds from importing the app to serving", multiprocess_mode="max"
+)
+CLICKS_WRITTEN = Counter(
+    "clicks_written_total", "Visits handled by the click flusher", ["result"]
+)
+RATE_LIMITED = Counter(
+    "requests_rejected_total", "Requests refused by a rate limit policy or shed under load", ["policy"]
+)
+
+# Seconds spent per dependency by the request running in this context
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def add_time(dependency: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[dependency] = timings.get(dependency, 0.0) + seconds
+
+@contextmanager
+def timed(dependency: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(dependency, time.perf_counter() - started)
+
+class MetricsMiddleware:
+    """Plain ASGI middleware recording latency and per-dependency time for every request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched endpoint in the scope; labelling by
+            # handler keeps cardinality bounded whatever paths clients request
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", type(endpoint).__name__) if endpoint else "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], handler, str(status_code)).observe(time.perf_counter() - started)
+            for dependency, seconds in timings.items():
+                DEPENDENCY_TIME.labels(dependency, handler).observe(seconds)
+            _request_timings.reset(token)
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with timed("redis"):
+            return await super().execute(raise_on_error)
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that charges command time to the current request."""
+
+    async def execute_command(self, *args, **options):
+        with timed("redis"):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+
+def instrument_engine(async_engine, capacity: int) -> None:
+    """Charge query time to the current request and track pool saturation."""
+    sync_engine = async_engine.sync_engine
+    POOL_CAPACITY.inc(capacity)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        add_time("postgres", time.perf_counter() - context._metrics_started)
+
+    @event.listens_for(sync_engine, "checkout")
+    def _checked_out(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(sync_engine, "checkin")
+    def _checked_in(dbapi_connection, connection_record):
+        POOL_CHECKED_OUT.dec()
+
+def render_metrics() -> tuple:
+    """Exposition body and content type for every worker's (or this process's) samples."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
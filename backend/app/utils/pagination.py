@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Output field name -> (columns it needs, how to render it from a row)
+FieldSpec = Tuple[Tuple[Any, ...], Callable[[Any], Any]]
+
+def _bad_request(en: str, tr: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail={"message": {"en": en, "tr": tr}}
+    )
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise _bad_request("Invalid cursor", "Geçersiz imleç")
+
+def parse_fields(fields: Optional[str], specs: Dict[str, FieldSpec]) -> List[str]:
+    """Split a fields= parameter, defaulting to every field the endpoint offers."""
+    if not fields:
+        return list(specs)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in specs]
+    if unknown or not names:
+        allowed = ", ".join(specs)
+        raise _bad_request(f"Unknown fields. Allowed: {allowed}", f"Bilinmeyen alanlar. İzin verilenler: {allowed}")
+    return names
+
+def projection(specs: Dict[str, FieldSpec], names: Sequence[str], *required) -> List[Any]:
+    """Columns to SELECT for the requested fields, plus any the caller always needs."""
+    columns = list(required)
+    for name in names:
+        for column in specs[name][0]:
+            if not any(column is existing for existing in columns):
+                columns.append(column)
+    return columns
+
+def render(row, specs: Dict[str, FieldSpec], names: Sequence[str]) -> dict:
+    return {name: specs[name][1](row) for name in names}
+
+def page_size(cursor: Optional[str], limit: Optional[int]) -> Optional[int]:
+    """Rows per page for a listing: None (every row, as before pagination
+    existed) when the client asks for neither a cursor nor a limit."""
+    if limit is None and cursor:
+        return DEFAULT_PAGE_SIZE
+    return limit
+
+def keyset_page(stmt, created_column, id_column, cursor: Optional[str], limit: Optional[int]):
+    """Newest-first page on (created_at, id) that seeks past the cursor instead of
+    using OFFSET, so every page costs the same. Fetches one extra row to detect a next page.
+    With limit None every remaining row is returned."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(created_column, id_column) < tuple_(created_at, row_id))
+    stmt = stmt.order_by(created_column.desc(), id_column.desc())
+    return stmt if limit is None else stmt.limit(limit + 1)
+
+def split_page(rows: Sequence[Any], limit: Optional[int]) -> Tuple[Sequence[Any], Optional[str]]:
+    """Trim the look-ahead row and build the cursor for the next page, if any."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
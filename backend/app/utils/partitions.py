@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from ..database import async_engine
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions created ahead of the current month
+VISIT_PARTITIONS_AHEAD = int(os.getenv("VISIT_PARTITIONS_AHEAD", "3"))
+# Raw visits are kept this many whole months; older partitions are folded into
+# url_daily_stats and dropped
+VISIT_RETENTION_MONTHS = int(os.getenv("VISIT_RETENTION_MONTHS", "13"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "86400"))
+PARTITION_LOCK_KEY = "partitions:url_visits:lock"
+
+_PARTITION_NAME = re.compile(r"^url_visits_(\d{4})_(\d{2})$")
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _partition_name(month: date) -> str:
+    return f"url_visits_{month.year:04d}_{month.month:02d}"
+
+def _existing_partitions(conn) -> List[Tuple[date, str]]:
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'url_visits'"
+    ))
+    partitions = []
+    for (name,) in rows:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match[1]), int(match[2]), 1), name))
+    return sorted(partitions)
+
+def ensure_partitions(conn, today: date = None) -> None:
+    """Create this month's and the next VISIT_PARTITIONS_AHEAD months' partitions, plus the default one."""
+    today = today or datetime.now(timezone.utc).date()
+    current = today.replace(day=1)
+    for offset in range(VISIT_PARTITIONS_AHEAD + 1):
+        month = _add_months(current, offset)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF url_visits "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+            f"TO ('{_add_months(month, 1).isoformat()} 00:00:00+00')"
+        ))
+    # Safety net only; stays empty while partitions are created ahead of time
+    conn.execute(text("CREATE TABLE IF NOT EXISTS url_visits_default PARTITION OF url_visits DEFAULT"))
+
+def ensure_visit_indexes(conn) -> None:
+    """Indexes create_all does not add to an existing url_visits. Built on the
+    partitioned parent, so every current and future partition gets them."""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_url_visits_url_id_created_at_id "
+        "ON url_visits (url_id, created_at, id)"
+    ))
+    # Superseded: the index above serves every query this one did
+    conn.execute(text("DROP INDEX IF EXISTS ix_url_visits_url_id_created_at"))
+
+def expired_partitions(conn, today: date = None) -> List[str]:
+    """Partitions wholly older than VISIT_RETENTION_MONTHS, oldest first."""
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = _add_months(today.replace(day=1), -VISIT_RETENTION_MONTHS)
+    return [name for month, name in _existing_partitions(conn) if month < cutoff]
+
+def expire_partition(conn, name: str) -> None:
+    """Fold one expired month into url_daily_stats, then detach and drop its partition."""
+    # Idempotent: recomputes the month's rollup rows from the raw visits
+    conn.execute(text(
+        "INSERT INTO url_daily_stats (url_id, day, country, clicks) "
+        "SELECT url_id, (created_at AT TIME ZONE 'UTC')::date, COALESCE(country, 'Unknown'), COUNT(*) "
+        f"FROM {name} WHERE url_id IS NOT NULL GROUP BY 1, 2, 3 "
+        "ON CONFLICT (url_id, day, country) DO UPDATE SET clicks = EXCLUDED.clicks"
+    ))
+    conn.execute(text(f"ALTER TABLE url_visits DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"Folded and dropped visit partition {name}")
+
+async def maintain_partitions() -> None:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(ensure_partitions)
+        expired = await conn.run_sync(expired_partitions)
+    # DETACH holds an ACCESS EXCLUSIVE lock on url_visits until commit, which
+    # blocks the click flusher; one transaction per month releases it right
+    # after each detach instead of across every following month's fold
+    for name in expired:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(expire_partition, name)
+
+async def _maintain_periodically(redis_client) -> None:
+    while True:
+        try:
+            if await redis_client.set(PARTITION_LOCK_KEY, os.getpid(), nx=True, ex=max(1, int(PARTITION_MAINTENANCE_INTERVAL * 0.9))):
+                await maintain_partitions()
+        except Exception:
+            logger.exception("url_visits partition maintenance failed")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+def start_partition_maintainer(redis_client) -> asyncio.Task:
+    """Start the per-worker task that creates future partitions and expires old ones."""
+    return asyncio.create_task(_maintain_periodically(redis_client), name="visit-partitions")
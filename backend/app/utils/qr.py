@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional
+
+from .metrics import QUEUE_DEPTH
+
+QR_CACHE_DIR = os.getenv(
+    "QR_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "static", "qr-cache")
+)
+# Disk budget for rendered images; least recently served files go first
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", "2"))
+
+QR_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+QR_SIZES = (128, 256, 512, 1024)
+QR_DEFAULT_SIZE = 256
+QR_BORDER = 4
+
+def qr_code_path(short_code: str) -> str:
+    """Where a link's QR code is served; links created before on-demand
+    rendering keep the PNG path stored on their row."""
+    return f"/qr/{short_code}"
+
+def render_qr(data: str, fmt: str, size: int) -> bytes:
+    """Render a QR code; runs in a pool process, so it imports qrcode itself."""
+    import qrcode
+    import qrcode.image.svg
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=QR_BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+    qr.box_size = box_size
+
+    buffer = BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class QRCache:
+    """Content-addressed on-disk cache of rendered QR images with an LRU size cap.
+    Renders happen in a process pool and concurrent requests for one image share a render."""
+
+    def __init__(self, directory: str, max_bytes: int, workers: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(data: str, fmt: str, size: int) -> str:
+        return hashlib.sha256(f"{data}\0{fmt}\0{size}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    async def get(self, data: str, fmt: str, size: int) -> str:
+        """Return the path of the rendered image, rendering it on first request."""
+        key = self.key(data, fmt, size)
+        path = self.path(key, fmt)
+        try:
+            # Bump mtime so eviction sees this file as recently used
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(data, fmt, size, path))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._finish(key))
+            QUEUE_DEPTH.labels("qr_renders").set(len(self._inflight))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str) -> None:
+        self._inflight.pop(key, None)
+        QUEUE_DEPTH.labels("qr_renders").set(len(self._inflight))
+
+    async def _render(self, data: str, fmt: str, size: int, path: str) -> str:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(self._executor, render_qr, data, fmt, size)
+        # Disk writes and occasional eviction scans stay off the event loop
+        await asyncio.to_thread(self._store, path, image)
+        return path
+
+    def _store(self, path: str, image: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        self._account(len(image))
+
+    def _account(self, added: int) -> None:
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._scan())
+        else:
+            self._total_bytes += added
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self) -> None:
+        """Delete least recently served files until the cache is 90% of its budget."""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+qr_cache = QRCache(QR_CACHE_DIR, QR_CACHE_MAX_BYTES, QR_RENDER_WORKERS)
@@ -0,0 +1,217 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+
+from .helpers import get_trusted_client_ip
+from .i18n import i18n
+from .metrics import RATE_LIMITED
+from .redis_client import redis_client
+from .shortcode import SHORT_CODE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to turn every rate limit off (e.g. for benchmarks/loadtest.py)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+# Identities a worker remembers as blocked without asking Redis again
+RATE_LIMIT_LOCAL_SIZE = int(os.getenv("RATE_LIMIT_LOCAL_SIZE", "10000"))
+# Requests one worker serves at once before it starts shedding load; 0 disables
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "256"))
+# Share of ADMISSION_MAX_IN_FLIGHT open to everything but redirects
+ADMISSION_LOW_PRIORITY_SHARE = float(os.getenv("ADMISSION_LOW_PRIORITY_SHARE", "0.75"))
+# Retry-After sent with a shed request
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+class RateLimitPolicy(NamedTuple):
+    name: str
+    rate: float   # tokens added per second
+    burst: int    # bucket size
+
+def _policy(name: str, per_minute: str, burst: str) -> RateLimitPolicy:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return RateLimitPolicy(
+        name,
+        float(os.getenv(f"{prefix}_PER_MINUTE", per_minute)) / 60,
+        int(os.getenv(f"{prefix}_BURST", burst))
+    )
+
+# Anonymous link creation, per client IP
+SHORTEN_POLICY = _policy("shorten", "30", "10")
+# Login attempts per client IP, and failed logins per attempted username from
+# one IP (keyed on both so nobody can lock an account out from elsewhere)
+LOGIN_IP_POLICY = _policy("login_ip", "20", "10")
+LOGIN_USER_POLICY = _policy("login_user", "10", "5")
+# Account creation per client IP
+REGISTER_POLICY = _policy("register", "5", "3")
+
+# Token bucket kept as a hash of (tokens, updated_ms). Redis's own clock is
+# used so every worker and node refills the bucket at the same pace. Takes
+# ARGV[3] tokens (0 only checks) when at least one is left. Returns
+# {allowed, milliseconds until one more token}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1]) / 1000
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1000)
+
+if allowed == 1 then
+    return {1, 0}
+end
+return {0, math.ceil((1 - tokens) / rate)}
+"""
+
+_token_bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+class BlockedIdentities:
+    """Bounded map of identity -> monotonic time its bucket has a token again.
+    Lets a worker turn away a client Redis already refused without a round trip."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, key: str) -> float:
+        with self._lock:
+            until = self._data.get(key)
+            if until is None:
+                return 0.0
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                del self._data[key]
+                return 0.0
+            return remaining
+
+    def block(self, key: str, seconds: float) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = time.monotonic() + seconds
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+blocked = BlockedIdentities(RATE_LIMIT_LOCAL_SIZE)
+
+def rate_limit_key(policy: RateLimitPolicy, identity: str) -> str:
+    return f"ratelimit:{policy.name}:{identity}"
+
+def _too_many_requests(policy: RateLimitPolicy, seconds: float) -> HTTPException:
+    RATE_LIMITED.labels(policy.name).inc()
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail={"message": i18n.get_bilingual_response("rate_limited")},
+        headers={"Retry-After": str(max(1, math.ceil(seconds)))}
+    )
+
+async def _take(policy: RateLimitPolicy, identity: str, cost: int) -> float:
+    """Seconds until identity's bucket has a token again, 0 when it had one.
+    Redis failures let the request through rather than locking everyone out."""
+    if not RATE_LIMIT_ENABLED:
+        return 0.0
+    key = rate_limit_key(policy, identity)
+
+    seconds = blocked.retry_after(key)
+    if seconds:
+        return seconds
+
+    try:
+        allowed, retry_ms = await _token_bucket(keys=[key], args=[policy.rate, policy.burst, cost])
+    except Exception as e:
+        logger.warning(f"Rate limit check for {policy.name} skipped: {e!r}")
+        return 0.0
+    if allowed:
+        return 0.0
+    seconds = int(retry_ms) / 1000
+    blocked.block(key, seconds)
+    return seconds
+
+async def enforce(policy: RateLimitPolicy, identity: str) -> None:
+    """Take one token from identity's bucket or raise 429 with Retry-After."""
+    seconds = await _take(policy, identity, 1)
+    if seconds:
+        raise _too_many_requests(policy, seconds)
+
+async def check(policy: RateLimitPolicy, identity: str) -> None:
+    """Raise 429 with Retry-After if identity's bucket is empty, without taking a token."""
+    seconds = await _take(policy, identity, 0)
+    if seconds:
+        raise _too_many_requests(policy, seconds)
+
+async def charge(policy: RateLimitPolicy, identity: str) -> None:
+    """Take one token from identity's bucket; the next check() reports it once empty."""
+    await _take(policy, identity, 1)
+
+def limit_by_ip(policy: RateLimitPolicy):
+    """Route dependency applying policy to the client IP."""
+    async def dependency(request: Request) -> None:
+        await enforce(policy, get_trusted_client_ip(request))
+    return dependency
+
+# Same shape nginx routes to the redirect handler (see utils/shortcode.py)
+_SHORT_CODE_PATH = re.compile(rf"/[A-Za-z0-9]{{{SHORT_CODE_LENGTH}}}")
+# Single-segment routes that are not redirects, whatever their length
+_RESERVED_PATHS = {"/health", "/metrics", "/docs", "/redoc", "/admin", "/user", "/auth", "/public", "/static"}
+
+def _is_redirect(scope) -> bool:
+    """GET /{short_code}, so scrapes and health checks do not spend the redirect budget."""
+    path = scope["path"]
+    return (
+        scope["method"] in ("GET", "HEAD")
+        and _SHORT_CODE_PATH.fullmatch(path) is not None
+        and path not in _RESERVED_PATHS
+    )
+
+class AdmissionMiddleware:
+    """
+    Per-worker load shedding. Once ADMISSION_LOW_PRIORITY_SHARE of
+    ADMISSION_MAX_IN_FLIGHT requests are in progress, new requests other than
+    redirects get a 503 with Retry-After; redirects are admitted until the
+    full limit, so link clicks keep working while the API backs off.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.low_priority_limit = int(ADMISSION_MAX_IN_FLIGHT * ADMISSION_LOW_PRIORITY_SHARE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or ADMISSION_MAX_IN_FLIGHT <= 0:
+            return await self.app(scope, receive, send)
+
+        limit = ADMISSION_MAX_IN_FLIGHT if _is_redirect(scope) else self.low_priority_limit
+        if self.in_flight >= limit:
+            RATE_LIMITED.labels("shed").inc()
+            response = JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"message": i18n.get_bilingual_response("overloaded")},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+            )
+            return await response(scope, receive, send)
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
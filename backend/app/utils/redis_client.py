@@ -0,0 +1,9 @@
+import os
+
+from .metrics import InstrumentedRedis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# One connection pool per worker, shared by every router and background task.
+# Creating the client does not connect; the first command does.
+redis_client = InstrumentedRedis.from_url(REDIS_URL, decode_responses=True)
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import string
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..database import AsyncSessionLocal, URL, short_code_block_seq
+
+ALPHABET = string.ascii_letters + string.digits
+# nginx only routes /[A-Za-z0-9]{6} to the redirect handler
+SHORT_CODE_LENGTH = 6
+KEYSPACE = len(ALPHABET) ** SHORT_CODE_LENGTH
+
+# Sequence values leased per worker at a time. Block n starts at
+# (n - 1) * SHORT_CODE_BLOCK_SIZE, so this must never change once codes have
+# been issued: a different size makes new blocks overlap issued ones
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+# Key of the short code permutation. Deliberately not derived from SECRET_KEY:
+# it must never change once codes have been issued, while the JWT secret may
+# be rotated. Deployments that predate it set it to their SECRET_KEY
+SHORT_CODE_KEY = os.getenv("SHORT_CODE_KEY")
+if not SHORT_CODE_KEY:
+    raise RuntimeError("SHORT_CODE_KEY must be set to a stable secret that never changes once codes are issued")
+
+_HALF_BITS = 18  # 2**36 is the smallest even power of two >= KEYSPACE
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+class Permutation:
+    """Keyed Feistel network over [0, 2**36), cycle-walked down to [0, KEYSPACE).
+    Consecutive sequence values map to unrelated-looking codes, one-to-one."""
+
+    def __init__(self, key: str):
+        self._key = hashlib.sha256(key.encode("utf-8")).digest()
+
+    def _round(self, value: int, i: int) -> int:
+        digest = hashlib.blake2b(
+            bytes((i,)) + value.to_bytes(3, "big"), key=self._key, digest_size=3
+        ).digest()
+        return int.from_bytes(digest, "big") & _HALF_MASK
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in range(_ROUNDS):
+            left, right = right, left ^ self._round(right, i)
+        return (left << _HALF_BITS) | right
+
+    def __call__(self, index: int) -> int:
+        value = self._encrypt(index)
+        while value >= KEYSPACE:
+            value = self._encrypt(value)
+        return value
+
+def encode_base62(value: int) -> str:
+    chars = []
+    for _ in range(SHORT_CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+class ShortCodeAllocator:
+    """Hands out short codes from blocks of short_code_block_seq leased by this
+    worker; the next block is prefetched before the current one runs out."""
+
+    def __init__(self, block_size: int, key: str):
+        self.block_size = block_size
+        self._permute = Permutation(key)
+        self._next = 0
+        self._end = 0
+        self._prefetch: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def next_code(self) -> str:
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    await self._advance()
+
+        index = self._next
+        self._next += 1
+
+        if self._prefetch is None and self._end - self._next <= self.block_size // 10:
+            self._prefetch = asyncio.create_task(self._lease_block())
+
+        return encode_base62(self._permute(index))
+
+    async def next_codes(self, count: int) -> List[str]:
+        return [await self.next_code() for _ in range(count)]
+
+    async def _advance(self) -> None:
+        task, self._prefetch = self._prefetch, None
+        start = await (task or self._lease_block())
+        self._next, self._end = start, start + self.block_size
+
+    async def _lease_block(self) -> int:
+        async with AsyncSessionLocal() as db:
+            block = await db.scalar(select(short_code_block_seq.next_value()))
+        start = (block - 1) * self.block_size
+        if start + self.block_size > KEYSPACE:
+            raise RuntimeError("Short code keyspace exhausted")
+        return start
+
+short_code_allocator = ShortCodeAllocator(SHORT_CODE_BLOCK_SIZE, SHORT_CODE_KEY)
+
+async def insert_url(db, **values) -> URL:
+    """INSERT a URL under a freshly allocated short code. ON CONFLICT only
+    fires for codes already taken by legacy random links; the next code is used."""
+    while True:
+        short_code = await short_code_allocator.next_code()
+        url = await db.scalar(
+            pg_insert(URL)
+            .values(short_code=short_code, **values)
+            .on_conflict_do_nothing(index_elements=[URL.short_code])
+            .returning(URL)
+        )
+        if url is not None:
+            return url
+
+async def insert_urls(db, rows: List[dict]) -> List[dict]:
+    """Multi-row INSERT ... RETURNING for many URLs, each under a freshly allocated
+    short code. Returns one {id, short_code, original_url} per input row, in order."""
+    urls = URL.__table__
+    pending = list(range(len(rows)))
+    inserted: List[Optional[dict]] = [None] * len(rows)
+    while pending:
+        codes = await short_code_allocator.next_codes(len(pending))
+        by_code: Dict[str, int] = dict(zip(codes, pending))
+        result = await db.execute(
+            pg_insert(urls)
+            .values([dict(rows[i], short_code=code) for code, i in by_code.items()])
+            .on_conflict_do_nothing(index_elements=[urls.c.short_code])
+            .returning(urls.c.id, urls.c.short_code, urls.c.original_url)
+        )
+        for row in result:
+            inserted[by_code.pop(row.short_code)] = row._asdict()
+        # Whatever is left collided with a legacy random code
+        pending = list(by_code.values())
+    return inserted
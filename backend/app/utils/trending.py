@@ -0,0 +1,58 @@
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Longest window /trending can cover; per-minute buckets live this long
+TRENDING_MAX_WINDOW = int(os.getenv("TRENDING_MAX_WINDOW_MINUTES", "60"))
+TRENDING_DEFAULT_WINDOW = min(15, TRENDING_MAX_WINDOW)
+# Seconds a computed window ranking is reused before it is rebuilt from the buckets
+TRENDING_CACHE_SECONDS = int(os.getenv("TRENDING_CACHE_SECONDS", "10"))
+
+def _minute(timestamp: float) -> int:
+    return int(timestamp // 60)
+
+def trending_bucket_key(minute: int, user_id: Optional[int] = None) -> str:
+    """Sorted set of url_id -> clicks during one minute, site-wide or for one user's links."""
+    if user_id is None:
+        return f"trend:{minute}"
+    return f"trend:u:{user_id}:{minute}"
+
+async def record_trending(redis_client, visits: Iterable[dict], owners: Dict[int, Optional[int]]) -> None:
+    """ZINCRBY one flushed batch into the per-minute buckets in a single pipelined round trip."""
+    counts = Counter(
+        (_minute(visit["created_at"].timestamp()), visit["url_id"])
+        for visit in visits if visit["url_id"] in owners
+    )
+    if not counts:
+        return
+
+    ttl = (TRENDING_MAX_WINDOW + 1) * 60
+    keys = set()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for (minute, url_id), clicks in counts.items():
+            bucket_keys = [trending_bucket_key(minute)]
+            # Anonymous links only trend site-wide
+            if owners[url_id] is not None:
+                bucket_keys.append(trending_bucket_key(minute, owners[url_id]))
+            for key in bucket_keys:
+                pipe.zincrby(key, clicks, url_id)
+                keys.add(key)
+        for key in keys:
+            pipe.expire(key, ttl)
+        await pipe.execute()
+
+async def top_trending(redis_client, window: int, limit: int, user_id: Optional[int] = None) -> List[Tuple[int, int]]:
+    """The limit links with most clicks over the last window minutes, as
+    (url_id, clicks). The union of the window's buckets is cached for
+    TRENDING_CACHE_SECONDS, so most calls are a single ZREVRANGE."""
+    ranking_key = f"trend:top:{'all' if user_id is None else user_id}:{window}"
+    if not await redis_client.exists(ranking_key):
+        now = _minute(time.time())
+        buckets = [trending_bucket_key(minute, user_id) for minute in range(now - window + 1, now + 1)]
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(ranking_key, buckets)
+            pipe.expire(ranking_key, TRENDING_CACHE_SECONDS)
+            await pipe.execute()
+    ranked = await redis_client.zrevrange(ranking_key, 0, limit - 1, withscores=True)
+    return [(int(url_id), int(clicks)) for url_id, clicks in ranked]
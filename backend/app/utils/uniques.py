@@ -0,0 +1,47 @@
+import hashlib
+import os
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+# Daily unique-visitor sketches are kept this long; each costs at most ~12 KB
+UNIQUE_VISITOR_RETENTION_DAYS = int(os.getenv("UNIQUE_VISITOR_RETENTION_DAYS", "400"))
+
+def unique_visitors_key(url_id: int, day: date) -> str:
+    return f"uv:{url_id}:{day.isoformat()}"
+
+def visitor_id(ip_address: str, user_agent: str) -> str:
+    """Stable, non-reversible identity of a visitor; raw IPs never reach Redis."""
+    raw = f"{ip_address}\0{user_agent}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+async def record_visitors(redis_client, visits: Iterable[dict]) -> None:
+    """PFADD one batch of visits into their link's daily HyperLogLog, one
+    PFADD per link and day, all in a single pipelined round trip."""
+    visitors: Dict[str, set] = defaultdict(set)
+    for visit in visits:
+        key = unique_visitors_key(visit["url_id"], visit["created_at"].date())
+        visitors[key].add(visitor_id(visit["ip_address"] or "", visit["user_agent"] or ""))
+    if not visitors:
+        return
+
+    ttl = UNIQUE_VISITOR_RETENTION_DAYS * 86400
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key, ids in visitors.items():
+            pipe.pfadd(key, *ids)
+            pipe.expire(key, ttl)
+        await pipe.execute()
+
+async def count_unique_visitors(redis_client, url_id: int, days: List[date]) -> Tuple[Dict[date, int], int]:
+    """Unique visitors per day and across all the given days. The range total
+    is a PFCOUNT over every day's key, which merges the sketches on the fly
+    (PFMERGE without storing the result), so no raw visit is ever scanned."""
+    if not days:
+        return {}, 0
+    keys = [unique_visitors_key(url_id, day) for day in days]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.pfcount(key)
+        pipe.pfcount(*keys)
+        counts = await pipe.execute()
+    return dict(zip(days, counts[:-1])), counts[-1]
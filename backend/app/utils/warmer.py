@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import select, func
+
+from ..database import AsyncSessionLocal, URL, URLDailyStat
+from .cache import cache_urls, l1_cache, to_cached, unpack_url, url_cache_key
+from .trending import TRENDING_MAX_WINDOW, top_trending
+
+logger = logging.getLogger(__name__)
+
+# How many of the hottest links are kept warm in Redis
+CACHE_WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", "10000"))
+# Links are ranked by clicks over this many recent days, then by all-time clicks
+CACHE_WARM_DAYS = int(os.getenv("CACHE_WARM_DAYS", "1"))
+CACHE_WARM_INTERVAL = float(os.getenv("CACHE_WARM_INTERVAL", "300"))
+# Longest a starting worker waits for warm-up before serving anyway
+CACHE_WARM_TIMEOUT = float(os.getenv("CACHE_WARM_TIMEOUT", "5"))
+
+# One worker per interval ranks links and refills Redis; the rest only read
+WARM_LOCK_KEY = "cache-warm:lock"
+# Space-separated short codes of the current hot set, hottest first
+HOT_CODES_KEY = "cache-warm:codes"
+WARM_BATCH_SIZE = 1000
+# How often a worker that did not take the lock checks for the holder's hot set
+HOT_CODES_POLL_INTERVAL = 0.1
+
+async def hottest_links(db, limit: int, trending_ids: List[int] = ()) -> List:
+    """Links trending right now first, then the most clicked links of the last
+    CACHE_WARM_DAYS days from the rollup, topped up with the most clicked
+    links overall when that is not enough."""
+    columns = (URL.id, URL.short_code, URL.original_url, URL.is_flagged)
+    rows = []
+    if trending_ids:
+        by_id = {row.id: row for row in await db.execute(select(*columns).where(URL.id.in_(trending_ids)))}
+        rows = [by_id[url_id] for url_id in trending_ids if url_id in by_id]
+    seen = {row.id for row in rows}
+
+    since = datetime.now(timezone.utc).date() - timedelta(days=CACHE_WARM_DAYS)
+    recent = select(
+        URLDailyStat.url_id,
+        func.sum(URLDailyStat.clicks).label("clicks")
+    ).where(URLDailyStat.day >= since)\
+     .group_by(URLDailyStat.url_id)\
+     .order_by(func.sum(URLDailyStat.clicks).desc())\
+     .limit(limit)\
+     .subquery()
+    for row in await db.execute(
+        select(*columns).join(recent, recent.c.url_id == URL.id).order_by(recent.c.clicks.desc())
+    ):
+        if row.id not in seen:
+            rows.append(row)
+            seen.add(row.id)
+    rows = rows[:limit]
+
+    if len(rows) < limit:
+        overall = await db.execute(
+            select(*columns).where(URL.click_count > 0).order_by(URL.click_count.desc()).limit(limit)
+        )
+        rows += [row for row in overall if row.id not in seen][:limit - len(rows)]
+    return rows
+
+async def _refill_redis(redis_client) -> int:
+    trending = await top_trending(redis_client, TRENDING_MAX_WINDOW, CACHE_WARM_TOP_N)
+    async with AsyncSessionLocal() as db:
+        rows = await hottest_links(db, CACHE_WARM_TOP_N, [url_id for url_id, _ in trending])
+    records = {row.short_code: to_cached(row) for row in rows if row.short_code}
+    codes = list(records)
+    for start in range(0, len(codes), WARM_BATCH_SIZE):
+        await cache_urls(redis_client, {code: records[code] for code in codes[start:start + WARM_BATCH_SIZE]})
+    await redis_client.set(HOT_CODES_KEY, " ".join(codes), ex=max(1, int(CACHE_WARM_INTERVAL * 2)))
+    return len(codes)
+
+async def _wait_for_hot_codes(redis_client) -> Optional[str]:
+    """The published hot set, waiting up to CACHE_WARM_TIMEOUT for the lock
+    holder to publish it (after a Redis restart or on the first deploy)."""
+    deadline = asyncio.get_running_loop().time() + CACHE_WARM_TIMEOUT
+    while True:
+        raw = await redis_client.get(HOT_CODES_KEY)
+        if raw is not None or asyncio.get_running_loop().time() >= deadline:
+            return raw
+        await asyncio.sleep(HOT_CODES_POLL_INTERVAL)
+
+async def _fill_l1(redis_client, raw: Optional[str]) -> int:
+    """Copy the hot set from Redis into this worker's L1, hottest first."""
+    codes = raw.split()[:l1_cache.maxsize] if raw else []
+    loaded = 0
+    for start in range(0, len(codes), WARM_BATCH_SIZE):
+        chunk = codes[start:start + WARM_BATCH_SIZE]
+        values = await redis_client.mget([url_cache_key(code) for code in chunk])
+        for code, value in zip(chunk, values):
+            record = unpack_url(value)
+            if record is not None:
+                l1_cache.set(code, record)
+                loaded += 1
+    return loaded
+
+async def warm_caches(redis_client) -> None:
+    if await redis_client.set(WARM_LOCK_KEY, os.getpid(), nx=True, ex=max(1, int(CACHE_WARM_INTERVAL * 0.9))):
+        cached = await _refill_redis(redis_client)
+        logger.info(f"Warmed {cached} hot links into Redis")
+        raw = await redis_client.get(HOT_CODES_KEY)
+    else:
+        raw = await _wait_for_hot_codes(redis_client)
+    loaded = await _fill_l1(redis_client, raw)
+    logger.info(f"Warmed {loaded} hot links into the L1 cache")
+
+async def _warm_periodically(redis_client) -> None:
+    while True:
+        await asyncio.sleep(CACHE_WARM_INTERVAL)
+        try:
+            await warm_caches(redis_client)
+        except Exception:
+            logger.exception("Cache warming failed")
+
+def start_cache_warmer(redis_client) -> asyncio.Task:
+    """Start the per-worker task that keeps the hottest links cached."""
+    return asyncio.create_task(_warm_periodically(redis_client), name="cache-warmer")
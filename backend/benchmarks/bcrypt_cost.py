@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Measure bcrypt verification throughput per CPU core at each cost factor,
+to pick BCRYPT_ROUNDS. One login costs one verify (plus one hash the first
+time a stored hash is moved to a new cost).
+
+    python benchmarks/bcrypt_cost.py --rounds 10 11 12 13 --seconds 3
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.passwords import hash_password, verify_password
+
+def measure(rounds: int, seconds: float) -> dict:
+    hashed = hash_password("benchmark-password", rounds)
+    verifies = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds or verifies < 3:
+        verify_password("benchmark-password", hashed)
+        verifies += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "rounds": rounds,
+        "verifies": verifies,
+        "ms_per_login": round(elapsed / verifies * 1000, 2),
+        "logins_per_sec_per_core": round(verifies / elapsed, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13, 14])
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent per cost factor")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rounds':>6} {'ms/login':>10} {'logins/s/core':>14}")
+    for rounds in args.rounds:
+        result = measure(rounds, args.seconds)
+        results.append(result)
+        print(f"{rounds:>6} {result['ms_per_login']:>10} {result['logins_per_sec_per_core']:>14}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "bcrypt_cost", "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
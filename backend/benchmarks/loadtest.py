@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Self-contained load test for the hot API paths. Runs the app in process over
+ASGI against a containerless Postgres (pgserver) and an in-process fake Redis
+(fakeredis), so it needs neither network access nor running services.
+
+For every dataset size it grows the urls table to that many links, then
+drives each scenario at a fixed concurrency and reports RPS and p50/p95/p99
+latency. Redirects and stats requests pick links from a Zipf distribution.
+
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/loadtest.py --links 1000 100000 1000000 --output after.json
+    python benchmarks/loadtest.py --links 1000 100000 --compare before.json --max-regression 0.1
+    python benchmarks/loadtest.py --compare before.json --against after.json
+
+Scenarios: redirect (GET /{short_code}), shorten (POST /public/shorten),
+stats (GET /user/stats/{short_code}) and login (POST /auth/login).
+Seeding 10M links takes several minutes; pass --database-url / --redis-url
+to run against real local services instead of the stand-ins.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ("redirect", "stats", "shorten", "login")
+BENCH_USERNAME = "loadtest"
+BENCH_PASSWORD = "loadtest-password"
+SEED_CHUNK = 50000
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_fake_redis() -> str:
+    """fakeredis speaking RESP on a loopback port, so the app's real client code is exercised."""
+    from fakeredis import TcpFakeServer
+
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}"
+
+def start_postgres(directory: str) -> str:
+    import pgserver
+
+    server = pgserver.get_server(directory, cleanup_mode="stop")
+    return server.get_uri()
+
+def configure_environment(args) -> None:
+    """Everything the app reads at import time must be set before it is imported."""
+    scratch = tempfile.mkdtemp(prefix="urlio-loadtest-")
+    database_url = args.database_url or start_postgres(os.path.join(scratch, "pg"))
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["ASYNC_DATABASE_URL"] = database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    os.environ["REDIS_URL"] = args.redis_url or start_fake_redis()
+    os.environ["QR_CACHE_DIR"] = os.path.join(scratch, "qr")
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    # Every request comes from one client at a fixed concurrency; measure the
+    # handlers, not the limiter refusing them
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    os.environ.setdefault("SHORT_CODE_KEY", "loadtest")
+    os.environ["ADMISSION_MAX_IN_FLIGHT"] = "0"
+    os.chdir(BACKEND_DIR)
+
+def zipf_index(count: int, exponent: float, rng: random.Random) -> int:
+    """Rank drawn from a Zipf-like distribution over [0, count), by inverting
+    the CDF of its continuous approximation; rank 0 is the hottest link."""
+    u = rng.random()
+    if abs(exponent - 1.0) < 1e-9:
+        rank = count ** u
+    else:
+        rank = ((count ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+    return min(count, int(rank)) - 1
+
+class Dataset:
+    """Links seeded for the benchmark user. Their short codes come from blocks
+    leased off short_code_block_seq, so they never collide with codes the app
+    allocates, and are recomputed on demand instead of being held in memory."""
+
+    def __init__(self):
+        from app.utils.shortcode import SHORT_CODE_BLOCK_SIZE, SHORT_CODE_KEY, Permutation, encode_base62
+
+        self.block_size = SHORT_CODE_BLOCK_SIZE
+        self._permute = Permutation(SHORT_CODE_KEY)
+        self._encode = encode_base62
+        self._block_starts: List[int] = []
+        self.count = 0
+        self.user_id: Optional[int] = None
+
+    def code(self, ordinal: int) -> str:
+        start = self._block_starts[ordinal // self.block_size]
+        return self._encode(self._permute(start + ordinal % self.block_size))
+
+    async def ensure_user(self) -> None:
+        from sqlalchemy import select
+        from app.database import AsyncSessionLocal, User
+        from app.utils.passwords import hash_password
+
+        async with AsyncSessionLocal() as db:
+            self.user_id = await db.scalar(select(User.id).where(User.username == BENCH_USERNAME))
+            if self.user_id is None:
+                user = User(
+                    username=BENCH_USERNAME,
+                    email=f"{BENCH_USERNAME}@example.com",
+                    password_hash=hash_password(BENCH_PASSWORD)
+                )
+                db.add(user)
+                await db.commit()
+                self.user_id = user.id
+
+    async def grow(self, target: int) -> None:
+        """COPY links in until the dataset holds target of them."""
+        from sqlalchemy import text
+        from app.database import AsyncSessionLocal, async_engine
+        from app.utils.bloom import build_short_code_filter, short_code_filter
+        from app.utils.counters import reconcile
+
+        if target <= self.count:
+            return
+        needed_blocks = -(-target // self.block_size) - len(self._block_starts)
+        async with AsyncSessionLocal() as db:
+            blocks = (await db.scalars(
+                text("SELECT nextval('short_code_block_seq') FROM generate_series(1, :n)"),
+                {"n": needed_blocks}
+            )).all()
+            await db.commit()
+        self._block_starts.extend((block - 1) * self.block_size for block in blocks)
+
+        now = datetime.now(timezone.utc)
+        async with async_engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            while self.count < target:
+                stop = min(target, self.count + SEED_CHUNK)
+                await raw.driver_connection.copy_records_to_table(
+                    "urls",
+                    columns=["user_id", "original_url", "short_code", "click_count", "is_flagged", "created_at"],
+                    records=[
+                        (self.user_id, f"https://example.com/{ordinal}", self.code(ordinal), 0, False, now)
+                        for ordinal in range(self.count, stop)
+                    ]
+                )
+                self.count = stop
+            await conn.commit()
+
+        async with AsyncSessionLocal() as db:
+            await reconcile(db)
+        short_code_filter.reset()
+        await build_short_code_filter()
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def drive(request: Callable, concurrency: int, duration: float, warmup: float) -> dict:
+    """Run request() from concurrency loops; only requests started after the warmup count."""
+    latencies: List[float] = []
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def loop():
+        nonlocal errors
+        while True:
+            begun = time.perf_counter()
+            if begun >= stop_at:
+                return
+            ok = await request()
+            if begun >= measure_from:
+                latencies.append(time.perf_counter() - begun)
+                errors += not ok
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3)
+    }
+
+def make_requests(client, dataset: Dataset, token: str, exponent: float, rng: random.Random) -> Dict[str, Callable]:
+    auth = {"Authorization": f"Bearer {token}"}
+
+    async def redirect():
+        code = dataset.code(zipf_index(dataset.count, exponent, rng))
+        return (await client.get(f"/{code}")).status_code == 302
+
+    async def stats():
+        code = dataset.code(zipf_index(dataset.count, exponent, rng))
+        return (await client.get(f"/user/stats/{code}", headers=auth)).status_code == 200
+
+    async def shorten():
+        body = {"original_url": f"https://example.org/{rng.getrandbits(64):x}"}
+        return (await client.post("/public/shorten", json=body)).status_code == 200
+
+    async def login():
+        body = {"username": BENCH_USERNAME, "password": BENCH_PASSWORD}
+        return (await client.post("/auth/login", json=body)).status_code == 200
+
+    return {"redirect": redirect, "stats": stats, "shorten": shorten, "login": login}
+
+async def run(args) -> dict:
+    import httpx
+    from asgi_lifespan import LifespanManager
+    from app.schema import prepare_database
+    from app.main import app
+
+    prepare_database()
+    rng = random.Random(args.seed)
+    dataset = Dataset()
+    results = []
+    async with LifespanManager(app, startup_timeout=60, shutdown_timeout=60):
+        await dataset.ensure_user()
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/auth/login", json={"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+            response.raise_for_status()
+            requests = make_requests(client, dataset, response.json()["access_token"], args.zipf, rng)
+
+            for links in sorted(args.links):
+                print(f"Seeding {links} links...", flush=True)
+                await dataset.grow(links)
+                for scenario in args.scenarios:
+                    result = await drive(requests[scenario], args.concurrency, args.duration, args.warmup)
+                    result.update(links=links, scenario=scenario, concurrency=args.concurrency)
+                    results.append(result)
+                    print(
+                        f"{links:>10} {scenario:>9} {result['rps']:>10} rps  p50 {result['p50_ms']}ms  "
+                        f"p95 {result['p95_ms']}ms  p99 {result['p99_ms']}ms  errors {result['errors']}",
+                        flush=True
+                    )
+
+    return {"meta": describe_run(args), "results": results}
+
+def describe_run(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "zipf": args.zipf,
+        "seed": args.seed,
+        "stand_ins": {"postgres": not args.database_url, "redis": not args.redis_url}
+    }
+
+def compare(baseline: dict, current: dict, max_regression: float) -> bool:
+    """Print RPS changes per (links, scenario, concurrency); False if any dropped past the threshold."""
+    def key(result):
+        return result["links"], result["scenario"], result["concurrency"]
+
+    before = {key(result): result for result in baseline["results"]}
+    passed = True
+    print(f"{'links':>10} {'scenario':>9} {'before':>10} {'after':>10} {'change':>8}")
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is None or not old["rps"]:
+            continue
+        change = result["rps"] / old["rps"] - 1
+        regressed = change < -max_regression
+        passed = passed and not regressed
+        print(
+            f"{result['links']:>10} {result['scenario']:>9} {old['rps']:>10} {result['rps']:>10} "
+            f"{change:>+8.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, nargs="+", default=[1000, 100000], help="dataset sizes, grown in order")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the link popularity distribution")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="fail if RPS dropped versus this results file")
+    parser.add_argument("--against", metavar="RESULTS", help="compare this results file instead of running")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed fractional RPS drop")
+    parser.add_argument("--database-url", help="use this Postgres instead of a pgserver instance")
+    parser.add_argument("--redis-url", help="use this Redis instead of fakeredis")
+    args = parser.parse_args()
+    # configure_environment changes into the backend directory
+    for name in ("output", "compare", "against"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    if args.against:
+        with open(args.against) as f:
+            current = json.load(f)
+    else:
+        configure_environment(args)
+        current = asyncio.run(run(args))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, current, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measure how long a fresh worker takes to become ready: importing app.main
+and running the lifespan startup. Fails when the median
+exceeds the target, so slow imports are caught before they reach autoscaling.
+
+    python benchmarks/startup.py --runs 5 --target 1.5
+
+Run it against the same Postgres and Redis as the app (DATABASE_URL,
+REDIS_URL): startup warms the caches with the hottest links, bounded by
+CACHE_WARM_TIMEOUT, and the schema must already exist (python -m app.schema).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from asgi_lifespan import LifespanManager
+import app.main
+imported = time.perf_counter()
+
+async def start():
+    async with LifespanManager(app.main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(start())
+print(json.dumps({"import": imported - started, "ready": ready - started}))
+"""
+
+def measure() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target", type=float, default=float(os.getenv("STARTUP_TARGET_SECONDS", "1.0")),
+                        help="max median seconds from import to ready")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    imports = statistics.median(run["import"] for run in runs)
+    ready = statistics.median(run["ready"] for run in runs)
+    print(f"median import {imports:.3f}s, import to ready {ready:.3f}s over {args.runs} runs (target {args.target}s)")
+    if ready > args.target:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
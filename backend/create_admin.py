@@ -13,7 +13,7 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.database import SessionLocal, User
-from app.utils.auth import hash_password
+from app.utils.passwords import hash_password
 
 def create_admin():
     db = SessionLocal()
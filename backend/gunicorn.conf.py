@@ -0,0 +1,22 @@
+import os
+import shutil
+import subprocess
+import sys
+
+def on_starting(server):
+    # Samples left over from a previous run would be summed into the new one
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    # Prepare the schema once, in a throwaway process, so workers start serving
+    # straight away and the master never imports the app. Its metrics are not
+    # worker metrics: a live gauge file left behind would overstate them
+    env = {name: value for name, value in os.environ.items() if name != "PROMETHEUS_MULTIPROC_DIR"}
+    subprocess.run([sys.executable, "-m", "app.schema"], check=True, env=env)
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,2 @@
+-- Lets the cache warmer rank recently clicked links with an index-only scan
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_url_daily_stats_day ON url_daily_stats(day) INCLUDE (url_id, clicks);
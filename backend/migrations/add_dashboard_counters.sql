@@ -0,0 +1,31 @@
+-- Incrementally maintained admin dashboard counters
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    url_count BIGINT NOT NULL DEFAULT 0,
+    total_clicks BIGINT NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_user_stats_total_clicks ON user_stats(total_clicks);
+
+CREATE TABLE IF NOT EXISTS site_stats (
+    id INTEGER PRIMARY KEY,
+    total_users BIGINT NOT NULL DEFAULT 0,
+    total_urls BIGINT NOT NULL DEFAULT 0,
+    total_clicks BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_urls_flagged ON urls(id) WHERE is_flagged;
+
+-- Initial fill; the backend's reconciler keeps these correct afterwards
+INSERT INTO user_stats (user_id, url_count, total_clicks)
+SELECT u.id, COUNT(l.id), COALESCE(SUM(l.click_count), 0)
+FROM users u LEFT JOIN urls l ON l.user_id = u.id
+WHERE NOT u.is_admin
+GROUP BY u.id
+ON CONFLICT (user_id) DO UPDATE SET url_count = EXCLUDED.url_count, total_clicks = EXCLUDED.total_clicks;
+
+INSERT INTO site_stats (id, total_users, total_urls, total_clicks)
+SELECT 1,
+       (SELECT COUNT(*) FROM users WHERE NOT is_admin),
+       (SELECT COUNT(*) FROM urls),
+       (SELECT COALESCE(SUM(click_count), 0) FROM urls)
+ON CONFLICT (id) DO UPDATE SET total_users = EXCLUDED.total_users, total_urls = EXCLUDED.total_urls, total_clicks = EXCLUDED.total_clicks;
@@ -0,0 +1,3 @@
+-- Keyset pagination indexes for /user/urls and the admin listings
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_urls_user_id_created_at_id ON urls(user_id, created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_created_at_id ON users(created_at, id);
@@ -0,0 +1,5 @@
+-- Lets per-link visit exports stream in (created_at, id) order without a sort.
+-- CONCURRENTLY is not supported on a partitioned table; `python -m app.schema`
+-- runs the same statements before workers start.
+CREATE INDEX IF NOT EXISTS ix_url_visits_url_id_created_at_id ON url_visits(url_id, created_at, id);
+DROP INDEX IF EXISTS ix_url_visits_url_id_created_at;
@@ -0,0 +1,18 @@
+-- Per-link daily/country click rollup used by /user/stats/{short_code}
+CREATE TABLE IF NOT EXISTS url_daily_stats (
+    url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    country VARCHAR(100) NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (url_id, day, country)
+);
+
+CREATE INDEX IF NOT EXISTS ix_url_visits_url_id_created_at ON url_visits(url_id, created_at);
+
+-- Backfill from existing raw visits (run once, before deploying the new backend)
+INSERT INTO url_daily_stats (url_id, day, country, clicks)
+SELECT url_id, (created_at AT TIME ZONE 'UTC')::date, COALESCE(country, 'Unknown'), COUNT(*)
+FROM url_visits
+WHERE url_id IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (url_id, day, country) DO UPDATE SET clicks = EXCLUDED.clicks;
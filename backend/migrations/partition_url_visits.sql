@@ -0,0 +1,55 @@
+-- Convert url_visits into a table range-partitioned by month on created_at.
+-- Run during a maintenance window with the backend stopped; the backend
+-- creates future partitions and retires expired ones from then on.
+BEGIN;
+
+ALTER TABLE url_visits RENAME TO url_visits_legacy;
+ALTER SEQUENCE url_visits_id_seq OWNED BY NONE;
+ALTER SEQUENCE url_visits_id_seq AS BIGINT;
+DROP INDEX IF EXISTS ix_url_visits_url_id_created_at;
+DROP INDEX IF EXISTS ix_url_visits_id;
+
+CREATE TABLE url_visits (
+    id BIGINT NOT NULL DEFAULT nextval('url_visits_id_seq'),
+    url_id INTEGER REFERENCES urls(id),
+    ip_address VARCHAR(45),
+    country VARCHAR(100),
+    user_agent TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE url_visits_id_seq OWNED BY url_visits.id;
+CREATE INDEX ix_url_visits_id ON url_visits(id);
+CREATE INDEX ix_url_visits_url_id_created_at ON url_visits(url_id, created_at);
+
+-- One partition per month that has visits, through three months ahead
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE((SELECT MIN(created_at) FROM url_visits_legacy), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '3 months',
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF url_visits FOR VALUES FROM (%L) TO (%L)',
+            'url_visits_' || to_char(month, 'YYYY_MM'),
+            month::text || ' 00:00:00+00',
+            (month + INTERVAL '1 month')::date::text || ' 00:00:00+00'
+        );
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS url_visits_default PARTITION OF url_visits DEFAULT;
+
+INSERT INTO url_visits (id, url_id, ip_address, country, user_agent, created_at)
+SELECT id, url_id, ip_address, country, user_agent, COALESCE(created_at, now())
+FROM url_visits_legacy;
+
+DROP TABLE url_visits_legacy;
+
+COMMIT;
@@ -0,0 +1,76 @@
+"""
+GET /admin/users/{user_id}/urls against an in-memory SQLite database, with
+and without cursor/limit. Run from backend/:
+
+    pip install -r requirements.txt -r tests/requirements.txt
+    python -m pytest -q tests
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import URL, User, get_db
+from app.main import app
+from app.routes.admin import get_admin_user
+from app.utils.cache import CachedUser
+
+LINKS = 5
+
+async def _request(*params: dict) -> list:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(User.metadata.create_all, tables=[User.__table__, URL.__table__])
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    async with sessions() as db:
+        db.add(User(id=1, username="owner", email="owner@example.com", password_hash="-"))
+        db.add_all(
+            URL(id=i, user_id=1, original_url=f"https://example.com/{i}", short_code=f"code{i:02d}",
+                click_count=i, created_at=started + timedelta(minutes=i))
+            for i in range(1, LINKS + 1)
+        )
+        await db.commit()
+
+    async def get_test_db():
+        async with sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = get_test_db
+    app.dependency_overrides[get_admin_user] = lambda: CachedUser(99, "admin", True, True, "en")
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [(await client.get("/admin/users/1/urls", params=query)) for query in params]
+    finally:
+        app.dependency_overrides.clear()
+        await engine.dispose()
+
+def test_without_cursor_or_limit_returns_every_url():
+    (response,) = asyncio.run(_request({}))
+    assert response.status_code == 200
+    body = response.json()
+    assert [url["id"] for url in body["urls"]] == list(range(LINKS, 0, -1))
+    assert body["total_urls"] == LINKS
+    assert body["next_cursor"] is None
+
+def test_limit_pages_through_every_url_with_the_cursor():
+    (first,) = asyncio.run(_request({"limit": 2}))
+    assert first.status_code == 200
+    body = first.json()
+    assert [url["id"] for url in body["urls"]] == [5, 4]
+    assert body["total_urls"] == LINKS
+    cursor = body["next_cursor"]
+    assert cursor
+
+    second, rest = asyncio.run(_request({"limit": 2, "cursor": cursor}, {"cursor": cursor}))
+    assert second.status_code == 200
+    assert [url["id"] for url in second.json()["urls"]] == [3, 2]
+    assert second.json()["total_urls"] is None
+
+    # A cursor alone gets a default-sized page
+    assert rest.status_code == 200
+    assert [url["id"] for url in rest.json()["urls"]] == [3, 2, 1]
+    assert rest.json()["next_cursor"] is None